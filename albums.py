@@ -0,0 +1,132 @@
+"""
+Сборка альбомов (media_group) из отдельных сообщений
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Album:
+    key: str
+    message: Message                 # Первое сообщение альбома (для ответа)
+    state: FSMContext
+    photos: list[Any] = field(default_factory=list)
+    count: int = 0                   # Сколько фото пришло всего (включая отброшенные)
+    caption: Optional[str] = None
+    started_at: float = field(default_factory=time.monotonic)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class MediaGroupCollector:
+    """
+    Собирает фото одного альбома и один раз вызывает callback.
+
+    На каждый альбом — один таймер, который перезапускается при
+    получении очередного фото. Альбом завершается, когда фото перестали
+    приходить на delay секунд, но не позже чем через ttl секунд после
+    первого фото. Хранится не больше max_photos фото на альбом и не больше
+    max_albums незавершённых альбомов: новый альбом сверх лимита
+    отбрасывается целиком, а по его первому фото один раз вызывается
+    on_overflow (ответить пользователю, что альбом не принят).
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[Album], Awaitable[None]],
+        delay: float = 0.6,
+        ttl: float = 10.0,
+        max_photos: int = 10,
+        max_albums: int = 1000,
+        on_overflow: Optional[Callable[[Message], Awaitable[None]]] = None
+    ):
+        self.callback = callback
+        self.on_overflow = on_overflow
+        self.delay = delay
+        self.ttl = ttl
+        self.max_photos = max_photos
+        self.max_albums = max_albums
+        self._albums: OrderedDict[str, Album] = OrderedDict()
+        # Отброшенные альбомы: key -> время первого фото; остальные их фото игнорируются
+        self._rejected: OrderedDict[str, float] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, key: str, message: Message, state: FSMContext, photo: Any, caption: Optional[str]):
+        """Добавляет фото в альбом и перезапускает его таймер"""
+        album = self._albums.get(key)
+        if album is None:
+            if self._is_rejected(key):
+                return
+            if len(self._albums) >= self.max_albums:
+                # Слишком много незавершённых альбомов — новый не принимаем,
+                # собираемые не трогаем: их фото ещё могут прийти
+                self._reject(key, message)
+                return
+            album = Album(key=key, message=message, state=state)
+            self._albums[key] = album
+
+        album.count += 1
+        if len(album.photos) < self.max_photos:
+            album.photos.append(photo)
+        if caption and not album.caption:
+            album.caption = caption.strip()
+
+        if album.timer is not None:
+            album.timer.cancel()
+        loop = asyncio.get_running_loop()
+        remaining = self.ttl - (time.monotonic() - album.started_at)
+        album.timer = loop.call_later(max(0.0, min(self.delay, remaining)), self._finish, key)
+
+    def _is_rejected(self, key: str) -> bool:
+        # Фото альбома приходят в пределах ttl, более старые отметки не нужны
+        now = time.monotonic()
+        while self._rejected and now - next(iter(self._rejected.values())) > self.ttl:
+            self._rejected.popitem(last=False)
+        return key in self._rejected
+
+    def _reject(self, key: str, message: Message):
+        logger.warning(f"Альбом {key} отброшен: собирается {len(self._albums)} альбомов")
+        self._rejected[key] = time.monotonic()
+        while len(self._rejected) > self.max_albums:
+            self._rejected.popitem(last=False)
+        if self.on_overflow is not None:
+            self._spawn(self._notify_overflow(message))
+
+    def _finish(self, key: str):
+        """Снимает альбом с учёта и запускает callback (ровно один раз)"""
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album.timer is not None:
+            album.timer.cancel()
+            album.timer = None
+        self._spawn(self._run(album))
+
+    def _spawn(self, coro: Awaitable[None]):
+        task = asyncio.create_task(coro)
+        # Держим ссылку на задачу, чтобы её не собрал GC
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, album: Album):
+        try:
+            await self.callback(album)
+        except Exception as e:
+            logger.exception(f"Ошибка обработки альбома {album.key}: {e}")
+
+    async def _notify_overflow(self, message: Message):
+        try:
+            await self.on_overflow(message)
+        except Exception as e:
+            logger.exception(f"Ошибка ответа на отброшенный альбом: {e}")
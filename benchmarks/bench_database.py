@@ -0,0 +1,410 @@
+"""
+Бенчмарк методов Database на объёмах, близких к продакшену
+
+    python benchmarks/bench_database.py                    # замер и сравнение с baseline.json
+    python benchmarks/bench_database.py --save-baseline    # сохранить результаты как новый baseline
+    python benchmarks/bench_database.py --ads 100000 --users 10000 --bans 5000   # быстрый прогон
+
+Данные генерируются детерминированно (--seed) в отдельный файл БД и
+переиспользуются между запусками, пока совпадают объёмы. Для каждого
+метода записывается EXPLAIN QUERY PLAN всех выполненных им запросов.
+Код завершается с ошибкой, если какой-то метод стал медленнее baseline
+больше чем на --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+DEFAULT_DB = BENCH_DIR / "bench.db"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+WORDS = (
+    "продам iPhone велосипед диван холодильник квартира аренда Лимассол Ларнака "
+    "Пафос Никосия новый б/у отличное состояние срочно торг цена евро доставка "
+    "самовывоз гарантия документы коробка зарядка детская коляска шкаф стол "
+    "стулья ноутбук телефон машина Toyota пробег км год выпуска пишите в личку"
+).split()
+
+
+@dataclass
+class Case:
+    name: str
+    func: Callable[[], object]
+    number: int  # Сколько раз вызвать
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    parser.add_argument("--ads", type=int, default=1_000_000, help="Объявлений в БД")
+    parser.add_argument("--users", type=int, default=100_000, help="Пользователей")
+    parser.add_argument("--bans", type=int, default=50_000, help="Забаненных пользователей")
+    parser.add_argument("--db", type=Path, default=DEFAULT_DB, help="Файл БД бенчмарка")
+    parser.add_argument("--reseed", action="store_true", help="Пересоздать данные")
+    parser.add_argument("--iterations", type=int, default=200, help="Вызовов на лёгкий метод")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Записать результаты в baseline")
+    parser.add_argument("--output", type=Path, help="Куда дополнительно сохранить результаты (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Допустимое замедление медианы относительно baseline (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Замедление меньше этого значения не считается регрессией (шум таймера)")
+    return parser.parse_args()
+
+
+# ==================== ДАННЫЕ ====================
+
+def fmt_ts(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def random_description(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 80))]
+    return " ".join(words) + f" {rng.randint(10, 5000)}€"
+
+
+# Часть фото повторяется в разных объявлениях (одно изображение выкладывают заново)
+REPOSTED_PHOTOS = ["AgACAgIAAxkBAAI" + "%064x" % i for i in range(1000)]
+
+
+def random_photo_ids(rng: random.Random) -> str:
+    return json.dumps([
+        rng.choice(REPOSTED_PHOTOS) if rng.random() < 0.02 else "AgACAgIAAxkBAAI" + "%064x" % rng.getrandbits(256)
+        for _ in range(rng.randint(1, 5))
+    ])
+
+
+def generate_ads(args: argparse.Namespace, rng: random.Random, now: datetime):
+    """Объявления за последний год; активные пользователи публикуют чаще"""
+    message_id = 0
+    for _ in range(args.ads):
+        user_id = 10_000_000 + int(args.users * rng.random() ** 2)
+        created = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+        status, moderated, reason, published = "pending", None, None, None
+        # Необработанными остаются только свежие объявления
+        if now - created > timedelta(days=2) or rng.random() < 0.5:
+            moderated = created + timedelta(seconds=int(rng.expovariate(1 / 1800)))
+            if rng.random() < 0.85:
+                status = "approved"
+                message_id += 1
+                published = message_id
+            else:
+                status = "rejected"
+                reason = "Нарушение правил"
+        yield (
+            user_id,
+            f"user{user_id}" if rng.random() < 0.7 else None,
+            "Имя",
+            random_description(rng),
+            random_photo_ids(rng),
+            status,
+            reason,
+            fmt_ts(created),
+            fmt_ts(moderated) if moderated else None,
+            published,
+        )
+
+
+def generate_bans(args: argparse.Namespace, rng: random.Random, now: datetime):
+    user_ids = rng.sample(range(10_000_000, 10_000_000 + args.users), min(args.bans, args.users))
+    for user_id in user_ids:
+        banned_at = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+        # Формат как у datetime, записанного через sqlite3 (см. Database.ban_user)
+        yield (user_id, f"user{user_id}", "Спам", str(banned_at), 1)
+
+
+def is_seeded(args: argparse.Namespace) -> bool:
+    if not args.db.exists():
+        return False
+    conn = sqlite3.connect(args.db)
+    try:
+        ads = conn.execute("SELECT COUNT(*) FROM advertisements").fetchone()[0]
+        bans = conn.execute("SELECT COUNT(*) FROM banned_users").fetchone()[0]
+        # БД, созданная до появления ad_photos, заполняется заново
+        photos = conn.execute("SELECT EXISTS (SELECT 1 FROM ad_photos)").fetchone()[0]
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+    return ads == args.ads and bans == min(args.bans, args.users) and (photos or not ads)
+
+
+def seed(args: argparse.Namespace, database_cls):
+    """Создаёт схему через Database и заливает данные"""
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{args.db}{suffix}").unlink(missing_ok=True)
+    database_cls(str(args.db)).close()
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA synchronous=OFF")
+    # Статистику заполнит Database при следующем открытии — так же,
+    # как при обновлении существующей БД; триггеры на миллион вставок не нужны
+    for trigger in ("trg_stats_submitted", "trg_stats_moderated", "trg_stats_deleted"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS daily_stats")
+    conn.execute("DROP TABLE IF EXISTS moderation_latency")
+
+    started = time.perf_counter()
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO advertisements
+                (user_id, username, first_name, description, photo_ids, status,
+                 reject_reason, created_at, moderated_at, published_message_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            generate_ads(args, rng, now)
+        )
+        conn.executemany(
+            "INSERT INTO banned_users (user_id, username, reason, banned_at, banned_by) VALUES (?, ?, ?, ?, ?)",
+            generate_bans(args, rng, now)
+        )
+        # Как у новых объявлений: ad_photos вместе с photo_ids (file_unique_id — хвост file_id)
+        conn.execute("""
+            INSERT INTO ad_photos (ad_id, position, file_id, file_unique_id, width, height)
+            SELECT a.id, photo.key, photo.value, substr(photo.value, -16), 1280, 960
+            FROM advertisements AS a, json_each(a.photo_ids) AS photo
+        """)
+    conn.execute("ANALYZE")
+    conn.close()
+    # Первое открытие пересоздаёт триггеры и заполняет статистику — не включаем его в замер
+    database_cls(str(args.db)).close()
+    print(f"Данные созданы за {time.perf_counter() - started:.1f} с")
+
+
+# ==================== ЗАМЕРЫ ====================
+
+def build_cases(database, args: argparse.Namespace, rng: random.Random) -> list[Case]:
+    # database уже импортирован в main() с DB_PATH бенчмарка
+    from database import AD_COLUMNS
+    
+    # Аргументы выбираются из rng, чтобы запуски были сравнимы между собой
+    user_ids = [10_000_000 + int(args.users * rng.random() ** 2) for _ in range(1000)]
+    ad_ids = [rng.randint(1, max(1, args.ads)) for _ in range(1000)]
+    with database._pool.reader() as conn:
+        pending_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM advertisements WHERE status = 'pending' ORDER BY created_at, id"
+        )]
+        rows = conn.execute(
+            f"SELECT {AD_COLUMNS} FROM advertisements WHERE id IN ({','.join('?' * len(ad_ids))})",
+            ad_ids
+        ).fetchall()
+    reposted_ids = [file_id[-16:] for file_id in REPOSTED_PHOTOS]
+    banned_ids = list(database._bans)
+    if not banned_ids:
+        banned_ids = [0]
+    banned_sorted = sorted(database._bans.values(), key=lambda ban: (ban.banned_at, ban.user_id))
+    free_user = 10_000_000 + args.users + 1  # Пользователь без объявлений и бана
+    middle_pending = pending_ids[len(pending_ids) // 2] if pending_ids else None
+    middle_ban = banned_sorted[len(banned_sorted) // 2].user_id if banned_sorted else None
+    n = args.iterations
+    heavy = max(3, n // 50)
+
+    def pick(values):
+        return values[rng.randrange(len(values))]
+
+    def add_delete():
+        ad_id = database.add_advertisement(
+            free_user, None, "Имя", random_description(rng), ["bench"], daily_limit=10 ** 9
+        )
+        database.delete_advertisement(ad_id, free_user)
+
+    def ban_unban():
+        database.ban_user(free_user, None, "bench", 1)
+        database.unban_user(free_user)
+
+    def row_to_ad():
+        database._row_to_ad(pick(rows))
+
+    def row_to_ad_decoded():
+        ad = database._row_to_ad(pick(rows))
+        ad.photo_ids, ad.status, ad.created_at, ad.moderated_at
+
+    cases = [
+        Case("get_advertisement", lambda: database.get_advertisement(pick(ad_ids)), n),
+        Case("get_advertisement[cached]", lambda: database.get_advertisement(middle_pending), n),
+        Case("get_pending_count", database.get_pending_count, n),
+        Case("get_pending_advertisements", database.get_pending_advertisements, heavy),
+        Case("get_pending_page", database.get_pending_page, n),
+        Case("get_pending_page[cursor]", lambda: database.get_pending_page(after_id=middle_pending), n),
+        Case("get_user_ads_today", lambda: database.get_user_ads_today(pick(user_ids)), n),
+        Case("get_user_advertisements", lambda: database.get_user_advertisements(pick(user_ids)), n),
+        Case("get_user_ads_page", lambda: database.get_user_ads_page(pick(user_ids)), n),
+        Case("get_ad_photos", lambda: database.get_ad_photos(pick(ad_ids)), n),
+        Case("find_ads_by_photo", lambda: database.find_ads_by_photo(pick(reposted_ids)), n),
+        Case("find_duplicate_photo_ads", lambda: database.find_duplicate_photo_ads(pick(ad_ids)), n),
+        Case("get_moderation_stats", database.get_moderation_stats, n),
+        Case("is_banned", lambda: database.is_banned(pick(banned_ids)), n * 10),
+        Case("get_ban_info", lambda: database.get_ban_info(pick(banned_ids)), n * 10),
+        Case("get_banned_count", database.get_banned_count, n * 10),
+        Case("get_banned_users", database.get_banned_users, heavy),
+        Case("get_banned_page", database.get_banned_page, n),
+        Case("get_banned_page[cursor]", lambda: database.get_banned_page(before_user_id=middle_ban), n),
+        Case("add_advertisement+delete_advertisement", add_delete, n),
+        Case("ban_user+unban_user", ban_unban, n),
+        Case("_row_to_ad", row_to_ad, n * 10),
+        Case("_row_to_ad[decoded]", row_to_ad_decoded, n * 10),
+    ]
+    if not pending_ids:
+        cases = [case for case in cases if "pending_page[cursor]" not in case.name]
+    return cases
+
+
+def measure(case: Case) -> dict:
+    case.func()  # Прогрев: кэш страниц и подготовленных запросов
+    timings = []
+    for _ in range(case.number):
+        start = time.perf_counter()
+        case.func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "iterations": case.number,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "min_ms": timings[0] * 1000,
+    }
+
+
+def connections(database) -> list[sqlite3.Connection]:
+    return [database._pool._writer, *database._pool._readers.queue]
+
+
+def query_plans(database, cases: list[Case], db_path: Path) -> dict[str, list[str]]:
+    """EXPLAIN QUERY PLAN всех запросов, которые выполняет каждый метод"""
+    statements: list[str] = []
+    for conn in connections(database):
+        conn.set_trace_callback(statements.append)
+
+    plans = {}
+    explain_conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        for case in cases:
+            statements.clear()
+            case.func()
+            lines = []
+            seen = set()
+            for sql in statements:
+                sql = " ".join(sql.split())
+                if sql in seen or not sql.upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE")):
+                    continue
+                seen.add(sql)
+                # В плане храним запрос без значений параметров, чтобы его можно было сравнивать
+                lines.append(re.sub(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", "?", sql))
+                depth = {0: 0}
+                for node_id, parent, _, detail in explain_conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                    depth[node_id] = depth.get(parent, 0) + 1
+                    lines.append("  " * depth[node_id] + detail)
+            plans[case.name] = lines
+    finally:
+        explain_conn.close()
+        for conn in connections(database):
+            conn.set_trace_callback(None)
+    return plans
+
+
+def compare(results: dict, plans: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """Печатает сравнение с baseline и возвращает список регрессий"""
+    regressions = []
+    base_results = baseline.get("results", {})
+    base_plans = baseline.get("plans", {})
+    print(f"\n{'метод':<42}{'медиана, мс':>14}{'p95, мс':>12}{'baseline':>12}{'×':>7}")
+    for name, result in results.items():
+        base = base_results.get(name)
+        line = f"{name:<42}{result['median_ms']:>14.4f}{result['p95_ms']:>12.4f}"
+        if base:
+            ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+            line += f"{base['median_ms']:>12.4f}{ratio:>7.2f}"
+            if ratio > 1 + tolerance and result["median_ms"] - base["median_ms"] > min_delta_ms:
+                line += "  ⚠️ медленнее"
+                regressions.append(name)
+        if name in base_plans and base_plans[name] != plans.get(name):
+            line += "  ℹ️ план изменился"
+        print(line)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    # Модуль database при импорте открывает глобальную БД по DB_PATH —
+    # направляем её в файл бенчмарка, чтобы не трогать рабочую ads.db
+    os.environ["DB_PATH"] = str(args.db)
+    import database as database_module
+    from config import config
+    database_module.db.close()
+
+    if args.reseed or not is_seeded(args):
+        print(f"Генерация данных: {args.ads} объявлений, {args.users} пользователей, {args.bans} банов")
+        seed(args, database_module.Database)
+
+    started = time.perf_counter()
+    database = database_module.Database(
+        str(args.db),
+        read_connections=config.DB_READ_CONNECTIONS,
+        pragmas=config.db_pragmas(),
+        ad_cache_size=config.AD_CACHE_SIZE
+    )
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    rng = random.Random(args.seed)
+    cases = build_cases(database, args, rng)
+    results = {"Database.__init__": {"iterations": 1, "median_ms": startup_ms, "p95_ms": startup_ms, "min_ms": startup_ms}}
+    for case in cases:
+        results[case.name] = measure(case)
+    plans = query_plans(database, cases, args.db)
+    database.close()
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "ads": args.ads,
+            "users": args.users,
+            "bans": args.bans,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+        "plans": plans,
+    }
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        meta = baseline.get("meta", {})
+        if (meta.get("ads"), meta.get("users"), meta.get("bans")) != (args.ads, args.users, args.bans):
+            print("⚠️ Объёмы данных отличаются от baseline — сравнение условное")
+    regressions = compare(results, plans, baseline, args.tolerance, args.min_delta_ms)
+
+    for name, lines in plans.items():
+        print(f"\n[{name}]")
+        print("\n".join(lines) if lines else "  (без запросов к БД)")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nBaseline сохранён в {args.baseline}")
+    elif regressions:
+        print(f"\n❌ Замедлились: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
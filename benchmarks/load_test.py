@@ -0,0 +1,474 @@
+"""
+Нагрузочный тест бота целиком, без сети
+
+Поднимает локальную замену Bot API (getUpdates, sendMessage, sendPhoto,
+sendMediaGroup, answerCallbackQuery и т.д.) с настраиваемой задержкой и
+ответами 429, направляет на неё бота и диспетчер из bot.py и прогоняет
+через них синтетических пользователей: /start → «Добавить объявление» →
+фото или альбом с подписью → подтверждение → одобрение модератором.
+
+    python benchmarks/load_test.py --users 1000
+    python benchmarks/load_test.py --users 5000 --unthrottled        # без лимитов Telegram на исходящие
+    python benchmarks/load_test.py --api-latency-ms 80 --rate-429 0.02
+
+Замена Bot API работает в отдельном потоке со своим event loop, чтобы её
+работа не попадала в замер задержек event loop бота.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+ADMIN_ID = 999
+CHANNEL = "@loadtest"
+SEND_METHODS = ("sendmessage", "sendphoto", "sendmediagroup", "answercallbackquery")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальной заменой Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="Синтетических пользователей")
+    parser.add_argument("--ramp", type=float, default=10.0, help="За сколько секунд стартуют все пользователи")
+    parser.add_argument("--album-share", type=float, default=0.7, help="Доля объявлений с альбомом")
+    parser.add_argument("--api-latency-ms", type=float, default=30.0, help="Средняя задержка ответа Bot API")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля запросов отправки, получающих 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, секунд")
+    parser.add_argument("--step-timeout", type=float, default=120.0, help="Ожидание ответа бота на шаг, секунд")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="Снять лимиты исходящих сообщений (замер самого бота, а не лимитов Telegram)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Считать пик памяти Python (медленнее)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", type=Path, help="Сохранить отчёт в JSON")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить логи бота")
+    return parser.parse_args()
+
+
+def configure_env(args: argparse.Namespace, workdir: Path):
+    """Переменные окружения для config.py — до импорта модулей бота"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:LOADTEST",
+        "ADMIN_IDS": str(ADMIN_ID),
+        "CHANNEL_ID": CHANNEL,
+        "MODERATION_CHAT_ID": "0",
+        "DB_PATH": str(workdir / "ads.db"),
+        "FSM_DB_PATH": str(workdir / "fsm.db"),
+        "METRICS_PORT": "0",
+    })
+    if args.unthrottled:
+        os.environ["OUTBOUND_GLOBAL_RATE"] = "1000000"
+        os.environ["OUTBOUND_PRIVATE_RATE"] = "1000000"
+        os.environ["OUTBOUND_GROUP_RATE"] = "1000000"
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {
+        "count": len(ordered),
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+    }
+
+
+# ==================== ЗАМЕНА BOT API ====================
+
+class FakeBotAPI:
+    """
+    Минимальный Bot API на aiohttp.
+
+    Апдейты кладутся через push_update и отдаются в getUpdates. Каждое
+    сообщение, отправленное ботом в личный чат, передаётся в on_message
+    в event loop теста.
+    """
+
+    def __init__(self, args: argparse.Namespace, on_message, main_loop: asyncio.AbstractEventLoop):
+        self.latency = args.api_latency_ms / 1000
+        self.rate_429 = args.rate_429
+        self.retry_after = args.retry_after
+        self.on_message = on_message
+        self.main_loop = main_loop
+        self.rng = random.Random(args.seed)
+        self.calls: Counter[str] = Counter()
+        self.injected_429 = 0
+        self.message_ids = itertools.count(1)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.updates: Optional[asyncio.Queue] = None
+        self.base_url = ""
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="fake-bot-api", daemon=True)
+
+    def start(self) -> str:
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+
+    def push_update(self, update: dict):
+        self.loop.call_soon_threadsafe(self.updates.put_nowait, update)
+
+    def _serve(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.updates = asyncio.Queue()
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._ready.set()
+        self.loop.run_forever()
+
+    @staticmethod
+    def _chat(chat_id) -> dict:
+        if isinstance(chat_id, str) and chat_id.startswith("@"):
+            return {"id": -1001000000000, "type": "channel", "username": chat_id[1:]}
+        chat_id = int(chat_id)
+        return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": self._chat(chat_id), **fields}
+
+    @staticmethod
+    def _photo(file_id: str) -> list[dict]:
+        # Как в Telegram: file_unique_id свой у каждого изображения
+        unique_id = hashlib.md5(file_id.encode()).hexdigest()[:16]
+        return [{"file_id": file_id, "file_unique_id": unique_id, "width": 1280, "height": 960}]
+
+    def _deliver(self, chat_id, text: str):
+        chat = self._chat(chat_id)
+        if chat["type"] == "private":
+            self.main_loop.call_soon_threadsafe(self.on_message, chat["id"], text)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        self.calls[method] += 1
+
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(data)})
+
+        if method in SEND_METHODS:
+            if self.latency:
+                await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+            if self.rate_429 and self.rng.random() < self.rate_429:
+                self.injected_429 += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif method == "sendmessage":
+            result = self._message(data["chat_id"], text=data.get("text", ""))
+            self._deliver(data["chat_id"], data.get("text", ""))
+        elif method == "sendphoto":
+            caption = data.get("caption", "")
+            result = self._message(data["chat_id"], photo=self._photo(data["photo"]), caption=caption)
+            self._deliver(data["chat_id"], caption)
+        elif method == "sendmediagroup":
+            media = json.loads(data["media"])
+            result = [
+                self._message(data["chat_id"], photo=self._photo(item["media"]), media_group_id="album")
+                for item in media
+            ]
+            self._deliver(data["chat_id"], media[0].get("caption", ""))
+        else:
+            # answerCallbackQuery, editMessage*, deleteWebhook и прочее
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, data) -> list[dict]:
+        limit = int(data.get("limit", 100))
+        timeout = float(data.get("timeout", 0))
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=min(timeout, 1.0) or 0.01))
+        except asyncio.TimeoutError:
+            return batch
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+
+# ==================== ПОЛЬЗОВАТЕЛИ ====================
+
+class UnexpectedReply(Exception):
+    pass
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace, api: FakeBotAPI):
+        self.args = args
+        self.api = api
+        self.rng = random.Random(args.seed)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.inboxes: dict[int, asyncio.Queue] = {}
+        self.step_latency: dict[str, list[float]] = defaultdict(list)
+        self.flow_latency: list[float] = []
+        self.failures: Counter[str] = Counter()
+        self.unrouted_messages = 0
+
+    # Сообщения бота
+
+    def on_message(self, chat_id: int, text: str):
+        inbox = self.inboxes.get(chat_id)
+        if inbox is None:
+            # Чат модератора и т.п. — ответов там никто не ждёт
+            self.unrouted_messages += 1
+            return
+        inbox.put_nowait(text)
+
+    async def wait_reply(self, chat_id: int, marker: Optional[str] = None) -> str:
+        text = await asyncio.wait_for(self.inboxes[chat_id].get(), timeout=self.args.step_timeout)
+        if marker and marker not in text:
+            raise UnexpectedReply(text.split("\n", 1)[0][:60])
+        return text
+
+    # Апдейты от пользователей
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def send(self, user_id: int, **fields):
+        self.api.push_update({"update_id": next(self.update_ids), "message": self._message(user_id, **fields)})
+
+    def press(self, user_id: int, data: str):
+        self.api.push_update({
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": self._message(user_id, text=f"🆕 Новое объявление ({data})"),
+            },
+        })
+
+    async def step(self, name: str, chat_id: int, marker: Optional[str], action) -> str:
+        start = time.perf_counter()
+        action()
+        text = await self.wait_reply(chat_id, marker)
+        self.step_latency[name].append(time.perf_counter() - start)
+        return text
+
+    async def user_flow(self, index: int, delay: float):
+        await asyncio.sleep(delay)
+        user_id = 1_000_000 + index
+        self.inboxes[user_id] = asyncio.Queue()
+        caption = f"Продам велосипед №{index}, отличное состояние, 150€, Лимассол"
+        photos = self.rng.randint(2, 5) if self.rng.random() < self.args.album_share else 1
+        started = time.perf_counter()
+        try:
+            await self.step("start", user_id, None, lambda: self.send(user_id, text="/start"))
+            await self.step("add_ad", user_id, "Создание объявления",
+                            lambda: self.send(user_id, text="📝 Добавить объявление"))
+
+            def send_photos():
+                group = f"mg{user_id}" if photos > 1 else None
+                for k in range(photos):
+                    fields = {"photo": FakeBotAPI._photo(f"photo-{user_id}-{k:04d}-{'x' * 40}")}
+                    if k == 0:
+                        fields["caption"] = caption
+                    if group:
+                        fields["media_group_id"] = group
+                    self.send(user_id, **fields)
+
+            await self.step("album" if photos > 1 else "photo", user_id, "Превью", send_photos)
+            text = await self.step("confirm", user_id, "отправлено на модерацию",
+                                   lambda: self.send(user_id, text="✅ Отправить на модерацию"))
+            ad_id = int(re.search(r"#(\d+)", text).group(1))
+            await self.step("approve", user_id, "одобрено", lambda: self.press(ADMIN_ID, f"approve_{ad_id}"))
+            self.flow_latency.append(time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            self.failures["timeout"] += 1
+        except UnexpectedReply as e:
+            self.failures[f"unexpected reply: {e}"] += 1
+        finally:
+            self.inboxes.pop(user_id, None)
+
+
+async def monitor_loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux), МБ"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return 0.0
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import bot as bot_module
+    from database import adb, db
+
+    loop = asyncio.get_running_loop()
+    harness: Optional[Harness] = None
+    api = FakeBotAPI(args, lambda chat_id, text: harness.on_message(chat_id, text), loop)
+    harness = Harness(args, api)
+    base_url = api.start()
+
+    bot = bot_module.create_bot(AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    dp = bot_module.create_dispatcher()
+
+    rss_before = rss_mb()
+    if args.tracemalloc:
+        tracemalloc.start()
+    lag: list[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(lag, stop))
+    polling = asyncio.create_task(dp.start_polling(
+        bot,
+        handle_signals=False,
+        polling_timeout=1,
+        allowed_updates=["message", "callback_query", "chat_member"]
+    ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        harness.user_flow(i, args.ramp * i / max(1, args.users))
+        for i in range(args.users)
+    ))
+    duration = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    await dp.stop_polling()
+    await polling
+    # Рассылка модераторам идёт через outbox; невыполненное останется в таблице
+    pending_outbox = db.get_outbox_counts().get("pending", 0)
+    rss_after = rss_mb()
+    traced_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if args.tracemalloc else None
+    api.stop()
+    adb.close()
+    db.close()
+
+    updates = next(harness.update_ids) - 1
+    completed = len(harness.flow_latency)
+    return {
+        "users": args.users,
+        "completed": completed,
+        "failures": dict(harness.failures),
+        "duration_s": duration,
+        "updates": updates,
+        "updates_per_s": updates / duration,
+        "flows_per_s": completed / duration,
+        "step_latency_s": {name: percentiles(values) for name, values in harness.step_latency.items()},
+        "flow_latency_s": percentiles(harness.flow_latency),
+        "loop_lag_s": percentiles(lag),
+        "api_calls": dict(api.calls),
+        "injected_429": api.injected_429,
+        "moderator_messages": harness.unrouted_messages,
+        "pending_outbox": pending_outbox,
+        "rss_mb": {"before": rss_before, "after": rss_after,
+                   "peak": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024},
+        "tracemalloc_peak_mb": traced_peak,
+    }
+
+
+def print_report(report: dict):
+    print(f"\nПользователей: {report['users']}, завершили: {report['completed']}, "
+          f"за {report['duration_s']:.1f} с")
+    for reason, count in report["failures"].items():
+        print(f"  ❌ {reason}: {count}")
+    print(f"Апдейтов: {report['updates']} ({report['updates_per_s']:.1f}/с), "
+          f"сценариев: {report['flows_per_s']:.2f}/с")
+
+    print(f"\n{'шаг':<12}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    rows = list(report["step_latency_s"].items()) + [("весь путь", report["flow_latency_s"]),
+                                                      ("лаг loop", report["loop_lag_s"])]
+    for name, p in rows:
+        if p:
+            print(f"{name:<12}{p['count']:>7}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}"
+                  f"{p['p99'] * 1000:>10.1f}{p['max'] * 1000:>10.1f}")
+
+    print("\nЗапросы к Bot API: " + ", ".join(f"{m}={n}" for m, n in sorted(report["api_calls"].items())))
+    print(f"Ответов 429: {report['injected_429']}, сообщений модератору: {report['moderator_messages']}, "
+          f"задач outbox при остановке: {report['pending_outbox']}")
+    rss = report["rss_mb"]
+    line = f"Память: RSS {rss['before']:.0f} → {rss['after']:.0f} МБ, пик {rss['peak']:.0f} МБ"
+    if report["tracemalloc_peak_mb"] is not None:
+        line += f", пик Python-аллокаций {report['tracemalloc_peak_mb']:.1f} МБ"
+    print(line)
+
+
+def main():
+    args = parse_args()
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest-"))
+    configure_env(args, workdir)
+    try:
+        import bot  # noqa: F401 — настраивает логирование
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+            logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+            logging.getLogger("middlewares.timing").setLevel(logging.ERROR)
+            logging.getLogger("outbound").setLevel(logging.ERROR)
+        report = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,25 @@ Telegram Bot для объявлений с модерацией
 import asyncio
 import logging
 import sys
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import config
+from database import db, adb
 from handlers import user, admin, channel
+from metrics import start_metrics_server
+from middlewares.ban import BanMiddleware
+from middlewares.metrics import ApiMetricsMiddleware, HandlerMetricsMiddleware
+from middlewares.throttling import THROTTLE_LIMITS, ThrottlingMiddleware
+from middlewares.timing import UpdateTimingMiddleware
+from outbound import OutboundScheduler
+from outbox import outbox_worker
+from storage import SQLiteStorage
+from webhook import run_webhook
 
 
 # Настройка логирования
@@ -22,28 +33,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Фоновый перенос фото старых объявлений в ad_photos
+photo_migration: Optional[asyncio.Task] = None
 
-async def main():
-    """Точка входа"""
-    
-    # Проверяем конфигурацию
-    if config.BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        logger.error("❌ Ошибка: Укажите BOT_TOKEN в config.py или переменной окружения!")
-        logger.error("   Получите токен у @BotFather в Telegram")
-        return
-    
-    if not config.ADMIN_IDS:
-        logger.warning("⚠️ Предупреждение: Не указаны ADMIN_IDS!")
-        logger.warning("   Добавьте ID администраторов в config.py или переменную окружения")
-    
-    # Инициализация бота
+
+def create_bot(session: Optional[BaseSession] = None) -> Bot:
+    """Создаёт бота с планировщиком исходящих сообщений и метриками Bot API"""
     bot = Bot(
         token=config.BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    # Хранилище состояний (в памяти)
-    storage = MemoryStorage()
+    # Все исходящие сообщения идут через общий планировщик с лимитами Telegram
+    bot.session.middleware(OutboundScheduler(
+        global_rate=config.OUTBOUND_GLOBAL_RATE,
+        private_rate=config.OUTBOUND_PRIVATE_RATE,
+        group_rate=config.OUTBOUND_GROUP_RATE,
+        max_retries=config.OUTBOUND_MAX_RETRIES
+    ))
+    # Подключается после планировщика: меряет сами запросы, без ожидания в очереди
+    bot.session.middleware(ApiMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создаёт диспетчер с роутерами и middleware"""
+    # Хранилище состояний (SQLite, переживает перезапуск)
+    storage = SQLiteStorage(
+        config.FSM_DB_PATH,
+        flush_interval=config.FSM_FLUSH_INTERVAL,
+        ttl=config.FSM_TTL,
+        max_cached=config.FSM_MAX_CACHED,
+        max_entries=config.FSM_MAX_ENTRIES,
+        cleanup_interval=config.FSM_CLEANUP_INTERVAL
+    )
     
     # Диспетчер
     dp = Dispatcher(storage=storage)
@@ -53,20 +77,102 @@ async def main():
     dp.include_router(admin.router)
     dp.include_router(channel.router)
     
+    # Полное время обработки каждого апдейта и лог медленных
+    dp.update.outer_middleware(UpdateTimingMiddleware(threshold=config.SLOW_UPDATE_THRESHOLD_MS / 1000))
+    
+    # Апдейты забаненных пользователей отбрасываются до роутеров
+    ban_middleware = BanMiddleware()
+    dp.message.outer_middleware(ban_middleware)
+    dp.callback_query.outer_middleware(ban_middleware)
+    
+    # Анти-флуд для пользовательских обработчиков (по флагу throttle)
+    throttling = ThrottlingMiddleware(THROTTLE_LIMITS, max_buckets=config.THROTTLE_MAX_BUCKETS)
+    user.router.message.middleware(throttling)
+    user.router.callback_query.middleware(throttling)
+    
+    # Метрики по обработчикам
+    handler_metrics = HandlerMetricsMiddleware()
+    for router in (user.router, admin.router, channel.router):
+        for observer in (router.message, router.callback_query, router.chat_member):
+            observer.middleware(handler_metrics)
+    
+    # Публикация и уведомления после модерации (outbox) — пока работает диспетчер
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def on_startup(bot: Bot):
+    global photo_migration
+    outbox_worker.start(bot)
+    photo_migration = asyncio.create_task(migrate_photos())
+
+
+async def on_shutdown():
+    await outbox_worker.stop()
+    if photo_migration is not None and not photo_migration.done():
+        # Прогресс сохранён в БД — перенос продолжится при следующем запуске
+        photo_migration.cancel()
+
+
+async def migrate_photos():
+    """Переносит фото старых объявлений в ad_photos короткими транзакциями, не останавливая бота"""
+    batches = 0
+    try:
+        while await adb.migrate_ad_photos(config.PHOTO_MIGRATION_BATCH):
+            batches += 1
+            await asyncio.sleep(config.PHOTO_MIGRATION_PAUSE)
+    except Exception as e:
+        logger.error(f"Перенос фото в ad_photos прерван: {e}")
+        return
+    if batches:
+        logger.info("🖼 Фото старых объявлений перенесены в ad_photos")
+
+
+async def main():
+    """Точка входа"""
+    
+    # Проверяем конфигурацию
+    if config.BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        logger.error("❌ Ошибка: Укажите BOT_TOKEN в config.py или переменной окружения!")
+        logger.error("   Получите токен у @BotFather в Telegram")
+        return
+    
+    if not config.ADMIN_IDS:
+        logger.warning("⚠️ Предупреждение: Не указаны ADMIN_IDS!")
+        logger.warning("   Добавьте ID администраторов в config.py или переменную окружения")
+    
+    bot = create_bot()
+    dp = create_dispatcher()
+    
     # Запуск
     logger.info("🚀 Бот запускается...")
     logger.info(f"👤 Администраторы: {config.ADMIN_IDS}")
     logger.info(f"📢 Канал для публикации: {config.CHANNEL_ID}")
+    logger.info(f"🔌 Режим получения апдейтов: {config.BOT_MODE}")
+    
+    allowed_updates = ["message", "callback_query", "chat_member"]
+    
+    metrics_runner = await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+    if metrics_runner:
+        logger.info(f"📈 Метрики: http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
     
     try:
-        # Удаляем вебхук (если был) и запускаем polling
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(
-            bot, 
-            allowed_updates=["message", "callback_query", "chat_member"]
-        )
+        if config.BOT_MODE == "webhook":
+            await run_webhook(dp, bot, allowed_updates)
+        else:
+            # Удаляем вебхук (если был) и запускаем polling
+            await bot.delete_webhook(drop_pending_updates=config.DROP_PENDING_UPDATES)
+            await dp.start_polling(
+                bot, 
+                allowed_updates=allowed_updates
+            )
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
+        adb.close()
+        db.close()
 
 
 if __name__ == "__main__":
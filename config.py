@@ -21,12 +21,77 @@ class Config:
     # ID чата для модерации (куда приходят объявления на проверку)
     MODERATION_CHAT_ID: int = int(os.getenv("MODERATION_CHAT_ID", "0") or "0")
     
+    # Получение апдейтов: "polling" или "webhook"
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    # Сбрасывать ли апдейты, накопившиеся пока бот был выключен
+    DROP_PENDING_UPDATES: bool = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+    
+    # Вебхук
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")  # Публичный адрес, например https://bot.example.com
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")  # Проверяется в X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or "8080")
+    WEBHOOK_MAX_CONNECTIONS: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # Соединений со стороны Telegram
+    WEBHOOK_CONCURRENCY: int = int(os.getenv("WEBHOOK_CONCURRENCY", "100"))  # Апдейтов в обработке одновременно
+    
+    # Метрики Prometheus (GET /metrics); порт 0 — выключено
+    METRICS_HOST: str = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "0"))
+    # Апдейты дольше этого порога пишутся в лог с разбивкой по БД и Bot API
+    SLOW_UPDATE_THRESHOLD_MS: int = int(os.getenv("SLOW_UPDATE_THRESHOLD_MS", "500"))
+    
+    # База данных
+    DB_PATH: str = os.getenv("DB_PATH", "ads.db")
+    DB_READ_CONNECTIONS: int = int(os.getenv("DB_READ_CONNECTIONS", "4"))  # Соединений на чтение в пуле
+    DB_SYNCHRONOUS: str = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))  # Байт
+    DB_CACHE_SIZE_KB: int = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # Кэш страниц на соединение
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    AD_CACHE_SIZE: int = int(os.getenv("AD_CACHE_SIZE", "1000"))  # Объявлений в кэше (0 — без кэша)
+    PHOTO_MIGRATION_BATCH: int = int(os.getenv("PHOTO_MIGRATION_BATCH", "1000"))  # Объявлений за транзакцию
+    PHOTO_MIGRATION_PAUSE: float = float(os.getenv("PHOTO_MIGRATION_PAUSE", "0.05"))  # Секунд между пачками
+    
+    # FSM-хранилище (черновики объявлений, причины отклонения/бана)
+    FSM_DB_PATH: str = os.getenv("FSM_DB_PATH", "fsm.db")
+    FSM_FLUSH_INTERVAL: float = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))  # Секунд между записями на диск
+    FSM_TTL: int = int(os.getenv("FSM_TTL", "86400"))  # Через сколько секунд брошенный черновик удаляется
+    FSM_MAX_CACHED: int = int(os.getenv("FSM_MAX_CACHED", "10000"))  # Максимум состояний в памяти
+    FSM_MAX_ENTRIES: int = int(os.getenv("FSM_MAX_ENTRIES", "100000"))  # Максимум состояний на диске
+    FSM_CLEANUP_INTERVAL: int = int(os.getenv("FSM_CLEANUP_INTERVAL", "600"))  # Секунд между очистками диска
+    
     # Настройки объявлений
     MIN_PHOTOS: int = 1
     MAX_PHOTOS: int = 5
     MIN_DESCRIPTION_LENGTH: int = 10
     MAX_DESCRIPTION_LENGTH: int = 2000
     MAX_ADS_PER_DAY: int = 5  # Максимум объявлений в день
+    PENDING_PAGE_SIZE: int = 5  # Объявлений на странице очереди модерации
+    MY_ADS_PAGE_SIZE: int = 10  # Объявлений на странице «Мои объявления»
+    BANLIST_PAGE_SIZE: int = 10  # Пользователей на странице списка банов
+    STATS_DAYS: int = 7  # За сколько дней показывать статистику в /stats
+    
+    # Лимиты исходящих сообщений (сообщений в секунду)
+    OUTBOUND_GLOBAL_RATE: float = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+    OUTBOUND_PRIVATE_RATE: float = float(os.getenv("OUTBOUND_PRIVATE_RATE", "1"))  # В один личный чат
+    OUTBOUND_GROUP_RATE: float = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))  # В одну группу/канал
+    OUTBOUND_MAX_RETRIES: int = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # Повторов после RetryAfter
+    
+    # Анти-флуд: лимиты по классам действий — в middlewares/throttling.py
+    THROTTLE_MAX_BUCKETS: int = int(os.getenv("THROTTLE_MAX_BUCKETS", "10000"))  # Пар (пользователь, действие) в памяти
+    
+    # Outbox: публикация и уведомления после модерации
+    OUTBOX_POLL_INTERVAL: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))  # Секунд между проверками
+    OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY", "20"))  # Задач в работе одновременно
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_RETRY_DELAY: float = float(os.getenv("OUTBOX_RETRY_DELAY", "5"))  # Первая пауза, дальше удваивается
+    OUTBOX_SHUTDOWN_TIMEOUT: float = float(os.getenv("OUTBOX_SHUTDOWN_TIMEOUT", "10"))  # Ожидание начатых задач при остановке
+    OUTBOX_LEASE: float = float(os.getenv("OUTBOX_LEASE", "300"))  # Секунд, на которые задача захватывается в работу
+    
+    # Сборка альбомов
+    ALBUM_COLLECT_DELAY: float = 0.6  # Секунд тишины, после которых альбом считается полным
+    ALBUM_TTL: float = 10.0  # Максимальное время сборки одного альбома
+    ALBUM_MAX_PENDING: int = 1000  # Максимум одновременно собираемых альбомов
     
     # Правила размещения объявлений
     RULES: str = """
@@ -125,6 +190,17 @@ class Config:
                 self.ADMIN_IDS = [int(x.strip()) for x in admin_ids_str.split(",")]
             else:
                 self.ADMIN_IDS = []
+    
+    def db_pragmas(self) -> dict:
+        """PRAGMA для каждого соединения с SQLite"""
+        return {
+            "synchronous": self.DB_SYNCHRONOUS,
+            "mmap_size": self.DB_MMAP_SIZE,
+            # Отрицательное значение — размер в КиБ, а не в страницах
+            "cache_size": -self.DB_CACHE_SIZE_KB,
+            "busy_timeout": self.DB_BUSY_TIMEOUT_MS,
+            "temp_store": "MEMORY",
+        }
 
 
 config = Config()
@@ -1,13 +1,24 @@
+import asyncio
+import queue
 import sqlite3
 import json
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
 from enum import Enum
+from time import perf_counter
 from dataclasses import dataclass
 from typing import Optional
 
+from config import config
+from metrics import AD_CACHE_REQUESTS, DB_QUERY_LATENCY, trace_db
+
 
 class AdStatus(Enum):
     PENDING = "pending"      # На модерации
+    PUBLISHING = "publishing"  # Публикуется в канал (захвачено модератором)
     APPROVED = "approved"    # Одобрено
     REJECTED = "rejected"    # Отклонено
 
@@ -21,33 +32,221 @@ class BannedUser:
     banned_by: int
 
 
-@dataclass
 class Advertisement:
+    """
+    Объявление.
+
+    photo_ids, status и даты можно передать как есть или сырыми значениями
+    из БД (строками) — тогда они декодируются при первом обращении.
+    """
+    __slots__ = (
+        "id", "user_id", "username", "first_name", "description", "reject_reason",
+        "published_message_id", "_photo_ids", "_status", "_created_at", "_moderated_at"
+    )
+
+    def __init__(
+        self,
+        id: int,
+        user_id: int,
+        username: Optional[str],
+        first_name: str,
+        description: str,
+        photo_ids: list[str] | str,
+        status: AdStatus | str,
+        reject_reason: Optional[str],
+        created_at: Optional[datetime | str],
+        moderated_at: Optional[datetime | str],
+        published_message_id: Optional[int]
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.description = description
+        self.reject_reason = reject_reason
+        self.published_message_id = published_message_id
+        self._photo_ids = photo_ids
+        self._status = status
+        self._created_at = created_at
+        self._moderated_at = moderated_at
+
+    @property
+    def photo_ids(self) -> list[str]:
+        if isinstance(self._photo_ids, str):
+            self._photo_ids = json.loads(self._photo_ids)
+        return self._photo_ids
+
+    @property
+    def status(self) -> AdStatus:
+        if isinstance(self._status, str):
+            self._status = AdStatus(self._status)
+        return self._status
+
+    @property
+    def created_at(self) -> Optional[datetime]:
+        if isinstance(self._created_at, str):
+            self._created_at = datetime.fromisoformat(self._created_at) if self._created_at else None
+        return self._created_at
+
+    @property
+    def moderated_at(self) -> Optional[datetime]:
+        if isinstance(self._moderated_at, str):
+            self._moderated_at = datetime.fromisoformat(self._moderated_at) if self._moderated_at else None
+        return self._moderated_at
+
+    def __repr__(self) -> str:
+        return f"Advertisement(id={self.id}, user_id={self.user_id}, status={self.status.value})"
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite.
+
+    Одно соединение на запись (защищено блокировкой) и несколько на чтение.
+    В режиме WAL читатели не блокируются писателем.
+    """
+
+    def __init__(self, db_path: str, read_connections: int = 4, pragmas: Optional[dict] = None):
+        self.db_path = db_path
+        self.pragmas = pragmas or {}
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        # journal_mode сохраняется в файле БД, достаточно выставить один раз
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(max(1, read_connections)):
+            self._readers.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Соединение на запись; транзакция фиксируется при выходе"""
+        with self._write_lock:
+            # IMMEDIATE сразу берёт блокировку записи: чтение внутри
+            # транзакции и последующая запись выполняются атомарно
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Соединение на чтение из пула"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def close(self):
+        """Закрывает все соединения пула"""
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+
+# Верхние границы корзин гистограммы времени модерации, секунд
+LATENCY_BUCKETS = (
+    60, 5 * 60, 10 * 60, 30 * 60,
+    3600, 3 * 3600, 6 * 3600, 12 * 3600,
+    86400, 3 * 86400
+)
+LATENCY_OVERFLOW_BUCKET = 2 ** 31 - 1  # Дольше последней границы
+
+
+@dataclass
+class DailyStats:
+    day: str
+    submitted: int
+    approved: int
+    rejected: int
+    deleted: int
+
+
+@dataclass
+class ModerationStats:
+    days: list[DailyStats]             # От новых к старым
+    latency_median: Optional[int]      # Верхняя граница корзины, секунд
+    latency_p95: Optional[int]
+
+
+@dataclass
+class OutboxTask:
+    """Задача из outbox"""
+    id: int
+    kind: str
+    ad_id: Optional[int]
+    payload: dict
+    attempts: int
+
+
+@dataclass(slots=True)
+class AdPhoto:
+    """Фото объявления (таблица ad_photos)"""
+    file_id: str
+    file_unique_id: Optional[str] = None  # У перенесённых из photo_ids фото неизвестен
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+@dataclass(slots=True)
+class AdPreview:
+    """Краткие данные объявления для списков"""
     id: int
-    user_id: int
-    username: Optional[str]
-    first_name: str
-    description: str
-    photo_ids: list[str]
     status: AdStatus
-    reject_reason: Optional[str]
-    created_at: datetime
-    moderated_at: Optional[datetime]
-    published_message_id: Optional[int]
+    description: str  # Начало описания
+
+
+# Колонки объявления в порядке полей Advertisement (вместо SELECT *)
+AD_COLUMNS = (
+    "id, user_id, username, first_name, description, photo_ids, status, "
+    "reject_reason, created_at, moderated_at, published_message_id"
+)
 
 
 class Database:
-    def __init__(self, db_path: str = "ads.db"):
+    def __init__(
+        self,
+        db_path: str = "ads.db",
+        read_connections: int = 4,
+        pragmas: Optional[dict] = None,
+        ad_cache_size: int = 1000
+    ):
         self.db_path = db_path
+        self._pool = ConnectionPool(db_path, read_connections, pragmas)
         self._create_tables()
+        # LRU-кэш объявлений по ID; сбрасывается методами, меняющими объявление
+        self._ad_cache: OrderedDict[int, Advertisement] = OrderedDict()
+        self._ad_cache_size = ad_cache_size
+        self._ad_cache_lock = threading.Lock()
+        # Растёт при каждом сбросе: чтение, начатое до изменения, не положит в кэш старую версию
+        self._ad_cache_generation = 0
+        # Кэш таблицы banned_users: проверка бана без обращения к БД
+        self._bans: dict[int, BannedUser] = {}
+        self._load_bans()
     
-    def _get_connection(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def close(self):
+        """Закрывает соединения с БД"""
+        self._pool.close()
     
     def _create_tables(self):
-        with self._get_connection() as conn:
+        with self._pool.writer() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS advertisements (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -63,12 +262,16 @@ class Database:
                     published_message_id INTEGER
                 )
             """)
+            # Очередь модерации: фильтр по статусу и keyset-пагинация по (created_at, id)
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_status ON advertisements(status)
+                CREATE INDEX IF NOT EXISTS idx_status_created ON advertisements(status, created_at, id)
             """)
+            conn.execute("DROP INDEX IF EXISTS idx_status")
+            # Покрывает выборки объявлений пользователя по диапазону дат
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_user_id ON advertisements(user_id)
+                CREATE INDEX IF NOT EXISTS idx_user_created ON advertisements(user_id, created_at, id)
             """)
+            conn.execute("DROP INDEX IF EXISTS idx_user_id")
             # Таблица забаненных пользователей
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS banned_users (
@@ -79,7 +282,189 @@ class Database:
                     banned_by INTEGER NOT NULL
                 )
             """)
-            conn.commit()
+            # Keyset-пагинация списка банов от новых к старым
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_banned_at ON banned_users(banned_at, user_id)
+            """)
+            self._create_stats_tables(conn)
+            # Отложенные действия после модерации (публикация, уведомления),
+            # записываются в одной транзакции со сменой статуса объявления
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    ad_id INTEGER,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at, id)
+            """)
+            self._create_photo_tables(conn)
+    
+    def _create_photo_tables(self, conn: sqlite3.Connection):
+        """
+        Фото объявлений по одному в строке: поиск объявлений по фото без
+        декодирования photo_ids. photo_ids остаётся основным источником
+        для показа объявления, ad_photos пишется вместе с ним.
+        """
+        is_new = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ad_photos'"
+        ).fetchone() is None
+        
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ad_photos (
+                ad_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                width INTEGER,
+                height INTEGER,
+                PRIMARY KEY (ad_id, position)
+            ) WITHOUT ROWID
+        """)
+        # Одно и то же изображение в разных объявлениях
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ad_photos_unique ON ad_photos(file_unique_id, ad_id)
+            WHERE file_unique_id IS NOT NULL
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_ad_photos_deleted
+            AFTER DELETE ON advertisements
+            BEGIN
+                DELETE FROM ad_photos WHERE ad_id = OLD.id;
+            END
+        """)
+        # Состояние фоновых переносов данных: до какого ID уже обработано
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS migrations (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                until_id INTEGER NOT NULL
+            )
+        """)
+        
+        if is_new:
+            # Уже существующие объявления переносятся пачками в migrate_ad_photos,
+            # новые пишутся в ad_photos сразу
+            conn.execute("""
+                INSERT OR REPLACE INTO migrations (name, last_id, until_id)
+                SELECT 'ad_photos', 0, (SELECT MAX(id) FROM advertisements)
+                WHERE EXISTS (SELECT 1 FROM advertisements)
+            """)
+    
+    def _create_stats_tables(self, conn: sqlite3.Connection):
+        """
+        Таблицы статистики модерации.
+        
+        Счётчики обновляются триггерами в той же транзакции, что и изменение
+        объявления, поэтому /stats читает по строке на день вместо полного
+        просмотра advertisements. Дни считаются по UTC.
+        """
+        is_new = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'"
+        ).fetchone() is None
+        
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT PRIMARY KEY,
+                submitted INTEGER NOT NULL DEFAULT 0,
+                approved INTEGER NOT NULL DEFAULT 0,
+                rejected INTEGER NOT NULL DEFAULT 0,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Гистограмма времени модерации: bucket — верхняя граница в секундах
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS moderation_latency (
+                day TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, bucket)
+            )
+        """)
+        
+        bucket_sql = self._latency_bucket_sql("NEW.created_at", "NEW.moderated_at")
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_stats_submitted
+            AFTER INSERT ON advertisements
+            BEGIN
+                INSERT INTO daily_stats (day, submitted) VALUES (date(NEW.created_at), 1)
+                ON CONFLICT(day) DO UPDATE SET submitted = submitted + 1;
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_stats_moderated
+            AFTER UPDATE OF status ON advertisements
+            WHEN NEW.status IN ('approved', 'rejected')
+                AND OLD.status NOT IN ('approved', 'rejected')
+            BEGIN
+                INSERT INTO daily_stats (day, approved, rejected)
+                VALUES (
+                    date(NEW.moderated_at),
+                    NEW.status = 'approved',
+                    NEW.status = 'rejected'
+                )
+                ON CONFLICT(day) DO UPDATE SET
+                    approved = approved + excluded.approved,
+                    rejected = rejected + excluded.rejected;
+                INSERT INTO moderation_latency (day, bucket, count)
+                VALUES (date(NEW.moderated_at), {bucket_sql}, 1)
+                ON CONFLICT(day, bucket) DO UPDATE SET count = count + 1;
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_stats_deleted
+            AFTER DELETE ON advertisements
+            BEGIN
+                INSERT INTO daily_stats (day, deleted) VALUES (date('now'), 1)
+                ON CONFLICT(day) DO UPDATE SET deleted = deleted + 1;
+            END
+        """)
+        
+        if is_new:
+            # Однократно заполняем счётчики по уже существующим объявлениям.
+            # Старые версии писали moderated_at локальным datetime.now(),
+            # текущая — CURRENT_TIMESTAMP в UTC, как и created_at: старые значения переводим в UTC.
+            # CURRENT_TIMESTAMP — ровно 'YYYY-MM-DD HH:MM:SS', а в старых значениях есть
+            # разделитель 'T' (isoformat) или дробные секунды (адаптер sqlite3)
+            moderated_utc = (
+                "CASE WHEN instr(moderated_at, 'T') > 0 OR instr(moderated_at, '.') > 0 "
+                "THEN datetime(moderated_at, 'utc') ELSE moderated_at END"
+            )
+            conn.execute("""
+                INSERT INTO daily_stats (day, submitted)
+                SELECT date(created_at), COUNT(*) FROM advertisements GROUP BY date(created_at)
+            """)
+            conn.execute(f"""
+                INSERT INTO daily_stats (day, approved, rejected)
+                SELECT date({moderated_utc}), SUM(status = 'approved'), SUM(status = 'rejected')
+                FROM advertisements
+                WHERE status IN ('approved', 'rejected') AND moderated_at IS NOT NULL
+                GROUP BY 1
+                ON CONFLICT(day) DO UPDATE SET
+                    approved = approved + excluded.approved,
+                    rejected = rejected + excluded.rejected
+            """)
+            conn.execute(f"""
+                INSERT INTO moderation_latency (day, bucket, count)
+                SELECT date({moderated_utc}), {self._latency_bucket_sql("created_at", moderated_utc)}, COUNT(*)
+                FROM advertisements
+                WHERE status IN ('approved', 'rejected') AND moderated_at IS NOT NULL
+                GROUP BY 1, 2
+            """)
+    
+    @staticmethod
+    def _latency_bucket_sql(created_column: str, moderated_column: str) -> str:
+        """SQL-выражение: корзина гистограммы для времени модерации"""
+        seconds = f"(julianday({moderated_column}) - julianday({created_column})) * 86400"
+        cases = " ".join(f"WHEN {seconds} <= {bound} THEN {bound}" for bound in LATENCY_BUCKETS)
+        return f"CASE {cases} ELSE {LATENCY_OVERFLOW_BUCKET} END"
     
     def add_advertisement(
         self,
@@ -87,10 +472,23 @@ class Database:
         username: Optional[str],
         first_name: str,
         description: str,
-        photo_ids: list[str]
-    ) -> int:
-        """Добавляет новое объявление и возвращает его ID"""
-        with self._get_connection() as conn:
+        photo_ids: list[str],
+        daily_limit: Optional[int] = None,
+        photos: Optional[list[AdPhoto]] = None,
+        tasks: list[tuple[str, dict]] = ()
+    ) -> Optional[int]:
+        """
+        Добавляет новое объявление и возвращает его ID.
+        
+        Если указан daily_limit, проверка лимита и вставка выполняются
+        в одной транзакции. При превышении лимита возвращает None.
+        photos — данные фото в том же порядке, что photo_ids (для ad_photos).
+        tasks (уведомления модераторов) ставятся в outbox вместе со вставкой.
+        """
+        with self._pool.writer() as conn:
+            if daily_limit is not None:
+                if self._count_user_ads_today(conn, user_id) >= daily_limit:
+                    return None
             cursor = conn.execute(
                 """
                 INSERT INTO advertisements (user_id, username, first_name, description, photo_ids)
@@ -98,69 +496,416 @@ class Database:
                 """,
                 (user_id, username, first_name, description, json.dumps(photo_ids))
             )
-            conn.commit()
-            return cursor.lastrowid
+            ad_id = cursor.lastrowid
+            if photos is None:
+                photos = [AdPhoto(file_id) for file_id in photo_ids]
+            conn.executemany(
+                """
+                INSERT INTO ad_photos (ad_id, position, file_id, file_unique_id, width, height)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (ad_id, position, photo.file_id, photo.file_unique_id, photo.width, photo.height)
+                    for position, photo in enumerate(photos)
+                ]
+            )
+            for kind, payload in tasks:
+                self._enqueue(conn, kind, payload, ad_id)
+            return ad_id
+    
+    def get_ad_photos(self, ad_id: int) -> list[AdPhoto]:
+        """Фото объявления по порядку"""
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                """
+                SELECT file_id, file_unique_id, width, height FROM ad_photos
+                WHERE ad_id = ? ORDER BY position
+                """,
+                (ad_id,)
+            ).fetchall()
+            return [AdPhoto(*row) for row in rows]
+    
+    def find_ads_by_photo(self, file_unique_id: str, limit: int = 10) -> list[int]:
+        """ID объявлений с этим изображением, от новых к старым"""
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                """
+                SELECT DISTINCT ad_id FROM ad_photos
+                WHERE file_unique_id = ? ORDER BY ad_id DESC LIMIT ?
+                """,
+                (file_unique_id, limit)
+            ).fetchall()
+            return [row['ad_id'] for row in rows]
+    
+    def find_duplicate_photo_ads(self, ad_id: int, limit: int = 5) -> list[int]:
+        """ID других объявлений, где встречается хотя бы одно фото этого, от новых к старым"""
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                """
+                SELECT DISTINCT other.ad_id FROM ad_photos AS own
+                JOIN ad_photos AS other
+                    ON other.file_unique_id = own.file_unique_id AND other.ad_id != own.ad_id
+                WHERE own.ad_id = ? AND own.file_unique_id IS NOT NULL
+                ORDER BY other.ad_id DESC LIMIT ?
+                """,
+                (ad_id, limit)
+            ).fetchall()
+            return [row['ad_id'] for row in rows]
+    
+    def migrate_ad_photos(self, batch_size: int = 1000) -> bool:
+        """
+        Переносит photo_ids очередной пачки старых объявлений в ad_photos.
+        
+        Каждая пачка — отдельная короткая транзакция, чтобы не держать
+        блокировку записи. Возвращает True, пока перенос не закончен.
+        """
+        with self._pool.writer() as conn:
+            row = conn.execute(
+                "SELECT last_id, until_id FROM migrations WHERE name = 'ad_photos'"
+            ).fetchone()
+            if row is None:
+                return False
+            upper = min(row['last_id'] + batch_size, row['until_id'])
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO ad_photos (ad_id, position, file_id)
+                SELECT a.id, photo.key, photo.value
+                FROM advertisements AS a, json_each(a.photo_ids) AS photo
+                WHERE a.id > ? AND a.id <= ?
+                """,
+                (row['last_id'], upper)
+            )
+            if upper >= row['until_id']:
+                conn.execute("DELETE FROM migrations WHERE name = 'ad_photos'")
+                return False
+            conn.execute("UPDATE migrations SET last_id = ? WHERE name = 'ad_photos'", (upper,))
+            return True
     
     def get_advertisement(self, ad_id: int) -> Optional[Advertisement]:
-        """Получает объявление по ID"""
-        with self._get_connection() as conn:
+        """Получает объявление по ID (из кэша, если есть). Возвращённый объект менять нельзя"""
+        with self._ad_cache_lock:
+            ad = self._ad_cache.get(ad_id)
+            if ad is not None:
+                self._ad_cache.move_to_end(ad_id)
+            generation = self._ad_cache_generation
+        if ad is not None:
+            AD_CACHE_REQUESTS.inc(result="hit")
+            return ad
+        AD_CACHE_REQUESTS.inc(result="miss")
+        
+        with self._pool.reader() as conn:
             row = conn.execute(
-                "SELECT * FROM advertisements WHERE id = ?",
+                f"SELECT {AD_COLUMNS} FROM advertisements WHERE id = ?",
                 (ad_id,)
             ).fetchone()
-            
-            if row:
-                return self._row_to_ad(row)
+        if row is None:
             return None
+        
+        ad = self._row_to_ad(row)
+        with self._ad_cache_lock:
+            if generation == self._ad_cache_generation and self._ad_cache_size > 0:
+                self._ad_cache[ad_id] = ad
+                if len(self._ad_cache) > self._ad_cache_size:
+                    self._ad_cache.popitem(last=False)
+        return ad
+    
+    def _invalidate_ad(self, ad_id: int):
+        """Убирает объявление из кэша; вызывается после коммита изменения"""
+        with self._ad_cache_lock:
+            self._ad_cache.pop(ad_id, None)
+            self._ad_cache_generation += 1
     
     def get_pending_advertisements(self) -> list[Advertisement]:
         """Получает все объявления на модерации"""
-        with self._get_connection() as conn:
+        with self._pool.reader() as conn:
             rows = conn.execute(
-                "SELECT * FROM advertisements WHERE status = 'pending' ORDER BY created_at ASC"
+                f"SELECT {AD_COLUMNS} FROM advertisements WHERE status = 'pending' ORDER BY created_at ASC"
             ).fetchall()
             return [self._row_to_ad(row) for row in rows]
     
+    def get_pending_page(self, after_id: Optional[int] = None, limit: int = 5) -> list[Advertisement]:
+        """
+        Страница очереди модерации в порядке создания.
+        
+        after_id — ID последнего объявления предыдущей страницы (keyset-пагинация).
+        """
+        with self._pool.reader() as conn:
+            if after_id is None:
+                rows = conn.execute(
+                    f"""
+                    SELECT {AD_COLUMNS} FROM advertisements WHERE status = 'pending'
+                    ORDER BY created_at, id LIMIT ?
+                    """,
+                    (limit,)
+                ).fetchall()
+                return [self._row_to_ad(row) for row in rows]
+            
+            cursor_row = conn.execute(
+                "SELECT created_at FROM advertisements WHERE id = ?",
+                (after_id,)
+            ).fetchone()
+            if cursor_row is None:
+                # Объявление-курсор удалено: ID растут вместе с created_at
+                rows = conn.execute(
+                    f"""
+                    SELECT {AD_COLUMNS} FROM advertisements WHERE status = 'pending' AND id > ?
+                    ORDER BY created_at, id LIMIT ?
+                    """,
+                    (after_id, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"""
+                    SELECT {AD_COLUMNS} FROM advertisements
+                    WHERE status = 'pending' AND (created_at, id) > (?, ?)
+                    ORDER BY created_at, id LIMIT ?
+                    """,
+                    (cursor_row['created_at'], after_id, limit)
+                ).fetchall()
+            return [self._row_to_ad(row) for row in rows]
+    
     def get_user_advertisements(self, user_id: int) -> list[Advertisement]:
         """Получает все объявления пользователя"""
-        with self._get_connection() as conn:
+        with self._pool.reader() as conn:
             rows = conn.execute(
-                "SELECT * FROM advertisements WHERE user_id = ? ORDER BY created_at DESC",
+                f"SELECT {AD_COLUMNS} FROM advertisements WHERE user_id = ? ORDER BY created_at DESC",
                 (user_id,)
             ).fetchall()
             return [self._row_to_ad(row) for row in rows]
     
-    def approve_advertisement(self, ad_id: int, message_id: int) -> bool:
-        """Одобряет объявление"""
-        with self._get_connection() as conn:
-            conn.execute(
+    def get_user_ads_page(
+        self,
+        user_id: int,
+        before_id: Optional[int] = None,
+        limit: int = 10,
+        preview_length: int = 31
+    ) -> list[AdPreview]:
+        """
+        Страница объявлений пользователя, от новых к старым.
+        
+        before_id — ID последнего объявления предыдущей страницы (keyset-пагинация).
+        Из описания читаются только первые preview_length символов.
+        """
+        with self._pool.reader() as conn:
+            if before_id is None:
+                rows = conn.execute(
+                    """
+                    SELECT id, status, substr(description, 1, ?) AS description
+                    FROM advertisements WHERE user_id = ?
+                    ORDER BY created_at DESC, id DESC LIMIT ?
+                    """,
+                    (preview_length, user_id, limit)
+                ).fetchall()
+            else:
+                cursor_row = conn.execute(
+                    "SELECT created_at FROM advertisements WHERE id = ? AND user_id = ?",
+                    (before_id, user_id)
+                ).fetchone()
+                if cursor_row is None:
+                    # Объявление-курсор удалено: ID растут вместе с created_at
+                    rows = conn.execute(
+                        """
+                        SELECT id, status, substr(description, 1, ?) AS description
+                        FROM advertisements WHERE user_id = ? AND id < ?
+                        ORDER BY created_at DESC, id DESC LIMIT ?
+                        """,
+                        (preview_length, user_id, before_id, limit)
+                    ).fetchall()
+                else:
+                    rows = conn.execute(
+                        """
+                        SELECT id, status, substr(description, 1, ?) AS description
+                        FROM advertisements
+                        WHERE user_id = ? AND (created_at, id) < (?, ?)
+                        ORDER BY created_at DESC, id DESC LIMIT ?
+                        """,
+                        (preview_length, user_id, cursor_row['created_at'], before_id, limit)
+                    ).fetchall()
+            return [
+                AdPreview(id=row['id'], status=AdStatus(row['status']), description=row['description'])
+                for row in rows
+            ]
+    
+    def _claim(self, conn: sqlite3.Connection, ad_id: int) -> bool:
+        cursor = conn.execute(
+            "UPDATE advertisements SET status = 'publishing' WHERE id = ? AND status = 'pending'",
+            (ad_id,)
+        )
+        return cursor.rowcount > 0
+    
+    def queue_publication(self, ad_id: int, payload: Optional[dict] = None) -> bool:
+        """
+        Захватывает объявление (pending -> publishing) и ставит его публикацию в outbox.
+        
+        Возвращает False, если объявление уже обработано.
+        """
+        with self._pool.writer() as conn:
+            if not self._claim(conn, ad_id):
+                return False
+            self._enqueue(conn, "publish", payload or {}, ad_id)
+        self._invalidate_ad(ad_id)
+        return True
+    
+    def _release(self, conn: sqlite3.Connection, ad_id: int) -> bool:
+        cursor = conn.execute(
+            "UPDATE advertisements SET status = 'pending' WHERE id = ? AND status = 'publishing'",
+            (ad_id,)
+        )
+        return cursor.rowcount > 0
+    
+    def _approve(self, conn: sqlite3.Connection, ad_id: int, message_id: int) -> bool:
+        cursor = conn.execute(
+            """
+            UPDATE advertisements 
+            SET status = 'approved', moderated_at = CURRENT_TIMESTAMP, published_message_id = ?
+            WHERE id = ? AND status = 'publishing'
+            """,
+            (message_id, ad_id)
+        )
+        return cursor.rowcount > 0
+    
+    def complete_publication(
+        self,
+        task_id: int,
+        ad_id: int,
+        message_id: int,
+        tasks: list[tuple[str, dict]] = ()
+    ) -> bool:
+        """
+        Завершает задачу публикации: publishing -> approved и следующие задачи в outbox.
+        
+        Всё в одной транзакции: уведомления ставятся только вместе с одобрением.
+        """
+        with self._pool.writer() as conn:
+            approved = self._approve(conn, ad_id, message_id)
+            if approved:
+                for kind, payload in tasks:
+                    self._enqueue(conn, kind, payload, ad_id)
+            conn.execute("DELETE FROM outbox WHERE id = ?", (task_id,))
+        self._invalidate_ad(ad_id)
+        return approved
+    
+    def reject_advertisement(self, ad_id: int, reason: str, tasks: list[tuple[str, dict]] = ()) -> bool:
+        """
+        Отклоняет объявление с указанием причины: pending -> rejected.
+        
+        tasks ставятся в outbox в той же транзакции.
+        Возвращает False, если объявление уже обработано.
+        """
+        with self._pool.writer() as conn:
+            cursor = conn.execute(
                 """
                 UPDATE advertisements 
-                SET status = 'approved', moderated_at = ?, published_message_id = ?
-                WHERE id = ?
+                SET status = 'rejected', reject_reason = ?, moderated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
                 """,
-                (datetime.now(), message_id, ad_id)
+                (reason, ad_id)
             )
-            conn.commit()
-            return conn.total_changes > 0
+            if cursor.rowcount == 0:
+                return False
+            for kind, payload in tasks:
+                self._enqueue(conn, kind, payload, ad_id)
+        self._invalidate_ad(ad_id)
+        return True
     
-    def reject_advertisement(self, ad_id: int, reason: str) -> bool:
-        """Отклоняет объявление с указанием причины"""
-        with self._get_connection() as conn:
-            conn.execute(
+    def _enqueue(self, conn: sqlite3.Connection, kind: str, payload: dict, ad_id: Optional[int] = None):
+        conn.execute(
+            "INSERT INTO outbox (kind, ad_id, payload, next_attempt_at) VALUES (?, ?, ?, ?)",
+            (kind, ad_id, json.dumps(payload, ensure_ascii=False), datetime.now(timezone.utc).timestamp())
+        )
+    
+    def claim_outbox_tasks(self, limit: int = 20, lease: float = 300.0) -> list[OutboxTask]:
+        """
+        Забирает в работу задачи outbox, время которых подошло.
+        
+        Выбор и захват — один UPDATE: next_attempt_at сдвигается на lease секунд,
+        поэтому задачу не выдадут повторно, пока её выполняют. Если бот упадёт,
+        не завершив задачу, она снова станет доступна после lease.
+        """
+        now = datetime.now(timezone.utc).timestamp()
+        with self._pool.writer() as conn:
+            rows = conn.execute(
                 """
-                UPDATE advertisements 
-                SET status = 'rejected', reject_reason = ?, moderated_at = ?
+                UPDATE outbox SET next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at, id
+                    LIMIT ?
+                )
+                RETURNING id, kind, ad_id, payload, attempts
+                """,
+                (now + lease, now, limit)
+            ).fetchall()
+            rows.sort(key=lambda row: row['id'])
+            return [
+                OutboxTask(
+                    id=row['id'],
+                    kind=row['kind'],
+                    ad_id=row['ad_id'],
+                    payload=json.loads(row['payload']),
+                    attempts=row['attempts']
+                )
+                for row in rows
+            ]
+    
+    def complete_outbox_task(self, task_id: int, tasks: list[tuple[str, dict]] = ()) -> bool:
+        """Удаляет выполненную задачу и в той же транзакции ставит следующие tasks"""
+        with self._pool.writer() as conn:
+            cursor = conn.execute("DELETE FROM outbox WHERE id = ? RETURNING ad_id", (task_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            for kind, payload in tasks:
+                self._enqueue(conn, kind, payload, row['ad_id'])
+            return True
+    
+    def retry_outbox_task(self, task_id: int, error: str, delay: float) -> bool:
+        """Откладывает задачу после ошибки на delay секунд"""
+        with self._pool.writer() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?
                 WHERE id = ?
                 """,
-                (reason, datetime.now(), ad_id)
+                (error, datetime.now(timezone.utc).timestamp() + delay, task_id)
+            )
+            return cursor.rowcount > 0
+    
+    def fail_outbox_task(
+        self,
+        task_id: int,
+        error: str,
+        release_ad_id: Optional[int] = None,
+        tasks: list[tuple[str, dict]] = ()
+    ) -> bool:
+        """
+        Помечает задачу как невыполнимую (остаётся в таблице для разбора).
+        
+        Если указан release_ad_id, объявление в той же транзакции возвращается
+        на модерацию, и тогда же ставятся tasks (уведомление модератора).
+        """
+        with self._pool.writer() as conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (error, task_id)
             )
-            conn.commit()
-            return conn.total_changes > 0
+            if release_ad_id is not None and self._release(conn, release_ad_id):
+                for kind, payload in tasks:
+                    self._enqueue(conn, kind, payload, release_ad_id)
+        if release_ad_id is not None:
+            self._invalidate_ad(release_ad_id)
+        return cursor.rowcount > 0
+    
+    def get_outbox_counts(self) -> dict[str, int]:
+        """Количество задач outbox по статусам"""
+        with self._pool.reader() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM outbox GROUP BY status").fetchall()
+            return {row['status']: row['count'] for row in rows}
     
     def get_pending_count(self) -> int:
         """Возвращает количество объявлений на модерации"""
-        with self._get_connection() as conn:
+        with self._pool.reader() as conn:
             row = conn.execute(
                 "SELECT COUNT(*) as count FROM advertisements WHERE status = 'pending'"
             ).fetchone()
@@ -168,109 +913,257 @@ class Database:
     
     def delete_advertisement(self, ad_id: int, user_id: int) -> bool:
         """Удаляет объявление пользователя. Возвращает True если удалено."""
-        with self._get_connection() as conn:
+        with self._pool.writer() as conn:
             cursor = conn.execute(
                 "DELETE FROM advertisements WHERE id = ? AND user_id = ?",
                 (ad_id, user_id)
             )
-            conn.commit()
-            return cursor.rowcount > 0
+        self._invalidate_ad(ad_id)
+        return cursor.rowcount > 0
     
-    def get_user_ads_today(self, user_id: int) -> int:
-        """Возвращает количество объявлений пользователя за сегодня"""
-        with self._get_connection() as conn:
-            row = conn.execute(
+    def get_moderation_stats(self, days: int = 7) -> ModerationStats:
+        """Статистика модерации за последние days дней (по UTC)"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                "SELECT * FROM daily_stats WHERE day >= ? ORDER BY day DESC",
+                (since,)
+            ).fetchall()
+            histogram = conn.execute(
                 """
-                SELECT COUNT(*) as count FROM advertisements 
-                WHERE user_id = ? AND date(created_at) = date('now', 'localtime')
+                SELECT bucket, SUM(count) AS count FROM moderation_latency
+                WHERE day >= ? GROUP BY bucket ORDER BY bucket
                 """,
-                (user_id,)
-            ).fetchone()
-            return row['count']
+                (since,)
+            ).fetchall()
+        
+        buckets = [(row['bucket'], row['count']) for row in histogram]
+        return ModerationStats(
+            days=[
+                DailyStats(
+                    day=row['day'],
+                    submitted=row['submitted'],
+                    approved=row['approved'],
+                    rejected=row['rejected'],
+                    deleted=row['deleted']
+                )
+                for row in rows
+            ],
+            latency_median=self._histogram_percentile(buckets, 0.5),
+            latency_p95=self._histogram_percentile(buckets, 0.95)
+        )
+    
+    @staticmethod
+    def _histogram_percentile(buckets: list[tuple[int, int]], percentile: float) -> Optional[int]:
+        """Корзина, в которую попадает перцентиль (buckets отсортированы по границе)"""
+        total = sum(count for _, count in buckets)
+        if not total:
+            return None
+        threshold = percentile * total
+        cumulative = 0
+        for bound, count in buckets:
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return buckets[-1][0]
+    
+    def get_user_ads_today(self, user_id: int) -> int:
+        """Возвращает количество объявлений пользователя за сегодня"""
+        with self._pool.reader() as conn:
+            return self._count_user_ads_today(conn, user_id)
+    
+    def _count_user_ads_today(self, conn: sqlite3.Connection, user_id: int) -> int:
+        """Считает объявления пользователя за текущие локальные сутки"""
+        day_start, day_end = self._today_bounds_utc()
+        row = conn.execute(
+            """
+            SELECT COUNT(*) as count FROM advertisements 
+            WHERE user_id = ? AND created_at >= ? AND created_at < ?
+            """,
+            (user_id, day_start, day_end)
+        ).fetchone()
+        return row['count']
+    
+    @staticmethod
+    def _today_bounds_utc() -> tuple[str, str]:
+        """
+        Границы текущих локальных суток в UTC.
+        
+        created_at хранится как UTC (CURRENT_TIMESTAMP), поэтому сравниваем
+        столбец с готовыми границами, а не оборачиваем его в date().
+        """
+        today = date.today()
+        # astimezone() у наивного времени учитывает локальный часовой пояс и DST
+        start = datetime.combine(today, time.min).astimezone()
+        end = datetime.combine(today + timedelta(days=1), time.min).astimezone()
+        fmt = "%Y-%m-%d %H:%M:%S"
+        return (
+            start.astimezone(timezone.utc).strftime(fmt),
+            end.astimezone(timezone.utc).strftime(fmt)
+        )
+    
+    def _load_bans(self):
+        """Загружает таблицу банов в кэш"""
+        with self._pool.reader() as conn:
+            rows = conn.execute("SELECT * FROM banned_users").fetchall()
+        self._bans = {row['user_id']: self._row_to_ban(row) for row in rows}
     
     def ban_user(self, user_id: int, username: Optional[str], reason: str, banned_by: int) -> bool:
         """Банит пользователя"""
-        with self._get_connection() as conn:
+        banned_at = datetime.now()
+        with self._pool.writer() as conn:
             try:
                 conn.execute(
                     """
                     INSERT OR REPLACE INTO banned_users (user_id, username, reason, banned_at, banned_by)
                     VALUES (?, ?, ?, ?, ?)
                     """,
-                    (user_id, username, reason, datetime.now(), banned_by)
+                    (user_id, username, reason, banned_at, banned_by)
                 )
-                conn.commit()
-                return True
             except Exception:
                 return False
+        self._bans[user_id] = BannedUser(
+            user_id=user_id,
+            username=username,
+            reason=reason,
+            banned_at=banned_at,
+            banned_by=banned_by
+        )
+        return True
     
     def unban_user(self, user_id: int) -> bool:
         """Разбанивает пользователя"""
-        with self._get_connection() as conn:
-            conn.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
-            conn.commit()
-            return conn.total_changes > 0
+        with self._pool.writer() as conn:
+            cursor = conn.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
+        self._bans.pop(user_id, None)
+        return cursor.rowcount > 0
     
     def is_banned(self, user_id: int) -> bool:
-        """Проверяет, забанен ли пользователь"""
-        with self._get_connection() as conn:
-            row = conn.execute(
-                "SELECT 1 FROM banned_users WHERE user_id = ?",
-                (user_id,)
-            ).fetchone()
-            return row is not None
+        """Проверяет, забанен ли пользователь (из кэша)"""
+        return user_id in self._bans
     
     def get_ban_info(self, user_id: int) -> Optional[BannedUser]:
-        """Получает информацию о бане пользователя"""
-        with self._get_connection() as conn:
-            row = conn.execute(
-                "SELECT * FROM banned_users WHERE user_id = ?",
-                (user_id,)
-            ).fetchone()
-            if row:
-                return BannedUser(
-                    user_id=row['user_id'],
-                    username=row['username'],
-                    reason=row['reason'],
-                    banned_at=datetime.fromisoformat(row['banned_at']) if row['banned_at'] else None,
-                    banned_by=row['banned_by']
-                )
-            return None
+        """Получает информацию о бане пользователя (из кэша)"""
+        return self._bans.get(user_id)
     
     def get_banned_users(self) -> list[BannedUser]:
         """Получает список всех забаненных пользователей"""
-        with self._get_connection() as conn:
+        with self._pool.reader() as conn:
             rows = conn.execute(
                 "SELECT * FROM banned_users ORDER BY banned_at DESC"
             ).fetchall()
-            return [
-                BannedUser(
-                    user_id=row['user_id'],
-                    username=row['username'],
-                    reason=row['reason'],
-                    banned_at=datetime.fromisoformat(row['banned_at']) if row['banned_at'] else None,
-                    banned_by=row['banned_by']
-                )
-                for row in rows
-            ]
+            return [self._row_to_ban(row) for row in rows]
     
-    def _row_to_ad(self, row: sqlite3.Row) -> Advertisement:
-        """Конвертирует строку БД в объект Advertisement"""
-        return Advertisement(
-            id=row['id'],
+    def get_banned_count(self) -> int:
+        """Возвращает количество забаненных пользователей (из кэша)"""
+        return len(self._bans)
+    
+    def get_banned_page(
+        self,
+        before_user_id: Optional[int] = None,
+        limit: int = 10
+    ) -> tuple[list[BannedUser], bool]:
+        """
+        Страница списка забаненных, от новых банов к старым, и признак первой страницы.
+        
+        before_user_id — последний пользователь предыдущей страницы (keyset-пагинация).
+        Если его уже разбанили, возвращается первая страница.
+        """
+        with self._pool.reader() as conn:
+            cursor_row = None
+            if before_user_id is not None:
+                cursor_row = conn.execute(
+                    "SELECT banned_at FROM banned_users WHERE user_id = ?",
+                    (before_user_id,)
+                ).fetchone()
+            if cursor_row is None:
+                rows = conn.execute(
+                    "SELECT * FROM banned_users ORDER BY banned_at DESC, user_id DESC LIMIT ?",
+                    (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    """
+                    SELECT * FROM banned_users WHERE (banned_at, user_id) < (?, ?)
+                    ORDER BY banned_at DESC, user_id DESC LIMIT ?
+                    """,
+                    (cursor_row['banned_at'], before_user_id, limit)
+                ).fetchall()
+            return [self._row_to_ban(row) for row in rows], cursor_row is None
+    
+    def _row_to_ban(self, row: sqlite3.Row) -> BannedUser:
+        """Конвертирует строку БД в объект BannedUser"""
+        return BannedUser(
             user_id=row['user_id'],
             username=row['username'],
-            first_name=row['first_name'],
-            description=row['description'],
-            photo_ids=json.loads(row['photo_ids']),
-            status=AdStatus(row['status']),
-            reject_reason=row['reject_reason'],
-            created_at=datetime.fromisoformat(row['created_at']) if row['created_at'] else None,
-            moderated_at=datetime.fromisoformat(row['moderated_at']) if row['moderated_at'] else None,
-            published_message_id=row['published_message_id']
+            reason=row['reason'],
+            banned_at=datetime.fromisoformat(row['banned_at']) if row['banned_at'] else None,
+            banned_by=row['banned_by']
+        )
+    
+    def _row_to_ad(self, row: sqlite3.Row) -> Advertisement:
+        """Конвертирует строку БД (колонки AD_COLUMNS) в объект Advertisement без декодирования полей"""
+        return Advertisement(*row)
+
+
+class AsyncDatabase:
+    """
+    Асинхронная обёртка над Database.
+
+    Каждый вызов выполняется в отдельном пуле потоков, поэтому запросы
+    к SQLite не блокируют event loop и обработку апдейтов других пользователей.
+    """
+
+    def __init__(self, database: Database, max_workers: int = 1):
+        self.database = database
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="db"
         )
 
+    async def run(self, func, *args, **kwargs):
+        """Выполняет синхронную функцию в пуле потоков БД"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            lambda: func(*args, **kwargs)
+        )
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.database, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            with DB_QUERY_LATENCY.time(method=name):
+                return attr(*args, **kwargs)
+
+        async def method(*args, **kwargs):
+            # В трейс апдейта идёт и ожидание свободного потока
+            start = perf_counter()
+            try:
+                return await self.run(timed, *args, **kwargs)
+            finally:
+                trace_db(perf_counter() - start)
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def close(self):
+        """Дожидается завершения запросов и останавливает пул потоков"""
+        self._executor.shutdown(wait=True)
+
 
 # Глобальный экземпляр базы данных
-db = Database()
+db = Database(
+    config.DB_PATH,
+    read_connections=config.DB_READ_CONNECTIONS,
+    pragmas=config.db_pragmas(),
+    ad_cache_size=config.AD_CACHE_SIZE
+)
+
+# Асинхронный доступ к базе данных для обработчиков
+# (по потоку на каждое соединение чтения плюс одно на запись)
+adb = AsyncDatabase(db, max_workers=config.DB_READ_CONNECTIONS + 1)
 
@@ -1,6 +1,8 @@
 """
 Обработчики команд администратора
 """
+from typing import Optional
+
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
@@ -9,7 +11,8 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InputMediaPhoto
 
 from config import config
-from database import db, AdStatus
+from database import db, adb, AdStatus, LATENCY_BUCKETS, LATENCY_OVERFLOW_BUCKET
+from outbox import outbox_worker
 
 router = Router()
 
@@ -29,15 +32,10 @@ def is_admin(user_id: int) -> bool:
     return user_id in config.ADMIN_IDS
 
 
-@router.message(Command("admin"))
-async def cmd_admin(message: Message):
-    """Админ-панель"""
-    if not is_admin(message.from_user.id):
-        await message.answer("⛔ У вас нет доступа к этой команде.")
-        return
-    
-    pending_count = db.get_pending_count()
-    banned_count = len(db.get_banned_users())
+async def build_admin_panel() -> tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура админ-панели"""
+    pending_count = await adb.get_pending_count()
+    banned_count = db.get_banned_count()
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=f"📋 На модерации ({pending_count})", callback_data="admin_pending")],
@@ -45,13 +43,74 @@ async def cmd_admin(message: Message):
         [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh")]
     ])
     
-    await message.answer(
+    text = (
         "🔧 <b>Админ-панель</b>\n\n"
         f"📋 Объявлений на модерации: {pending_count}\n"
-        f"🚫 Забаненных пользователей: {banned_count}",
-        reply_markup=keyboard,
-        parse_mode="HTML"
+        f"🚫 Забаненных пользователей: {banned_count}"
     )
+    return text, keyboard
+
+
+async def build_banlist_page(
+    before_user_id: Optional[int] = None,
+    back_button: bool = False
+) -> Optional[tuple[str, InlineKeyboardMarkup]]:
+    """Текст и клавиатура страницы списка забаненных (None, если список пуст)"""
+    page_size = config.BANLIST_PAGE_SIZE
+    # Берём на одно больше, чтобы понять, есть ли следующая страница
+    banned_users, first_page = await adb.get_banned_page(before_user_id, limit=page_size + 1)
+    has_more = len(banned_users) > page_size
+    banned_users = banned_users[:page_size]
+    
+    if not banned_users:
+        return None
+    
+    # Создаём кнопки разбана для каждого пользователя
+    buttons = []
+    text = f"🚫 <b>Забаненные пользователи ({db.get_banned_count()}):</b>\n\n"
+    
+    for user in banned_users:
+        username_text = f"@{user.username}" if user.username else "—"
+        text += (
+            f"• <code>{user.user_id}</code> ({username_text})\n"
+            f"   📝 {user.reason}\n"
+            f"   📅 {user.banned_at.strftime('%d.%m.%Y')}\n\n"
+        )
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"✅ Разбанить {user.user_id}",
+                callback_data=f"unban_{user.user_id}"
+            )
+        ])
+    
+    # Навигация по страницам
+    navigation = []
+    # Если предыдущего пользователя разбанили, показана первая страница — кнопка не нужна
+    if not first_page:
+        navigation.append(InlineKeyboardButton(text="⏮ В начало", callback_data="admin_banlist"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(
+            text="➡️ Дальше",
+            callback_data=f"admin_banlist_{banned_users[-1].user_id}"
+        ))
+    if navigation:
+        buttons.append(navigation)
+    
+    if back_button:
+        buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")])
+    
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@router.message(Command("admin"))
+async def cmd_admin(message: Message):
+    """Админ-панель"""
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа к этой команде.")
+        return
+    
+    text, keyboard = await build_admin_panel()
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 
 @router.callback_query(F.data == "admin_refresh")
@@ -61,62 +120,33 @@ async def refresh_admin(callback: CallbackQuery):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
     
-    pending_count = db.get_pending_count()
-    banned_count = len(db.get_banned_users())
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"📋 На модерации ({pending_count})", callback_data="admin_pending")],
-        [InlineKeyboardButton(text=f"🚫 Забаненные ({banned_count})", callback_data="admin_banlist")],
-        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh")]
-    ])
-    
-    await callback.message.edit_text(
-        "🔧 <b>Админ-панель</b>\n\n"
-        f"📋 Объявлений на модерации: {pending_count}\n"
-        f"🚫 Забаненных пользователей: {banned_count}",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    text, keyboard = await build_admin_panel()
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer("✅ Обновлено")
 
 
 @router.callback_query(F.data == "admin_banlist")
+@router.callback_query(F.data.startswith("admin_banlist_"))
 async def show_banlist_callback(callback: CallbackQuery):
-    """Показать список забаненных по кнопке"""
+    """Показать список забаненных по кнопке (по страницам)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
     
-    banned_users = db.get_banned_users()
+    # admin_banlist_<ID> — страница после пользователя с этим ID
+    before_user_id = None
+    if callback.data.startswith("admin_banlist_"):
+        before_user_id = int(callback.data.split("_")[2])
     
-    if not banned_users:
+    page = await build_banlist_page(before_user_id, back_button=True)
+    
+    if not page:
         await callback.answer("✅ Нет забаненных пользователей!", show_alert=True)
         return
     
     await callback.answer()
     
-    buttons = [[InlineKeyboardButton(text="◀️ Назад", callback_data="admin_back")]]
-    text = "🚫 <b>Забаненные пользователи:</b>\n\n"
-    
-    for i, user in enumerate(banned_users[:10]):
-        username_text = f"@{user.username}" if user.username else "—"
-        text += (
-            f"{i+1}. <code>{user.user_id}</code> ({username_text})\n"
-            f"   📝 {user.reason}\n"
-            f"   📅 {user.banned_at.strftime('%d.%m.%Y')}\n\n"
-        )
-        buttons.insert(-1, [
-            InlineKeyboardButton(
-                text=f"✅ Разбанить {user.user_id}",
-                callback_data=f"unban_{user.user_id}"
-            )
-        ])
-    
-    if len(banned_users) > 10:
-        text += f"<i>...и ещё {len(banned_users) - 10}</i>"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
-    
+    text, keyboard = page
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
 
@@ -127,33 +157,29 @@ async def admin_back(callback: CallbackQuery):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
     
-    pending_count = db.get_pending_count()
-    banned_count = len(db.get_banned_users())
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"📋 На модерации ({pending_count})", callback_data="admin_pending")],
-        [InlineKeyboardButton(text=f"🚫 Забаненные ({banned_count})", callback_data="admin_banlist")],
-        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_refresh")]
-    ])
-    
-    await callback.message.edit_text(
-        "🔧 <b>Админ-панель</b>\n\n"
-        f"📋 Объявлений на модерации: {pending_count}\n"
-        f"🚫 Забаненных пользователей: {banned_count}",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
+    text, keyboard = await build_admin_panel()
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
 
 @router.callback_query(F.data == "admin_pending")
+@router.callback_query(F.data.startswith("admin_pending_"))
 async def show_pending(callback: CallbackQuery, bot: Bot):
-    """Показать объявления на модерации"""
+    """Показать объявления на модерации (по страницам)"""
     if not is_admin(callback.from_user.id):
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
     
-    ads = db.get_pending_advertisements()
+    # admin_pending_<ID> — следующая страница после объявления с этим ID
+    after_id = None
+    if callback.data.startswith("admin_pending_"):
+        after_id = int(callback.data.split("_")[2])
+    
+    page_size = config.PENDING_PAGE_SIZE
+    # Берём на одно больше, чтобы понять, есть ли следующая страница
+    ads = await adb.get_pending_page(after_id, limit=page_size + 1)
+    has_more = len(ads) > page_size
+    ads = ads[:page_size]
     
     if not ads:
         await callback.answer("✅ Нет объявлений на модерации!", show_alert=True)
@@ -161,7 +187,7 @@ async def show_pending(callback: CallbackQuery, bot: Bot):
     
     await callback.answer()
     
-    for ad in ads[:5]:  # Показываем первые 5
+    for ad in ads:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad.id}"),
@@ -207,6 +233,19 @@ async def show_pending(callback: CallbackQuery, bot: Bot):
                 chat_id=callback.from_user.id,
                 text=f"❌ Ошибка загрузки объявления #{ad.id}: {e}"
             )
+    
+    if has_more:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(
+                text=f"➡️ Следующие {page_size}",
+                callback_data=f"admin_pending_{ads[-1].id}"
+            )]
+        ])
+        await bot.send_message(
+            chat_id=callback.from_user.id,
+            text="📋 В очереди есть ещё объявления.",
+            reply_markup=keyboard
+        )
 
 
 @router.callback_query(F.data.startswith("approve_"))
@@ -217,7 +256,7 @@ async def approve_ad(callback: CallbackQuery, bot: Bot):
         return
     
     ad_id = int(callback.data.split("_")[1])
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         await callback.answer("❌ Объявление не найдено", show_alert=True)
@@ -227,61 +266,19 @@ async def approve_ad(callback: CallbackQuery, bot: Bot):
         await callback.answer("⚠️ Объявление уже обработано", show_alert=True)
         return
     
-    # Публикуем в канал
-    try:
-        username_text = f"@{ad.username}" if ad.username else ad.first_name
-        
-        caption = (
-            f"📢 <b>Новое объявление</b>\n\n"
-            f"{ad.description}\n\n"
-            f"👤 Автор: {username_text}"
-        )
-        
-        if len(ad.photo_ids) == 1:
-            msg = await bot.send_photo(
-                chat_id=config.CHANNEL_ID,
-                photo=ad.photo_ids[0],
-                caption=caption,
-                parse_mode="HTML"
-            )
-            message_id = msg.message_id
-        else:
-            media = [InputMediaPhoto(media=photo) for photo in ad.photo_ids]
-            media[0].caption = caption
-            media[0].parse_mode = "HTML"
-            
-            msgs = await bot.send_media_group(chat_id=config.CHANNEL_ID, media=media)
-            message_id = msgs[0].message_id
-        
-        # Обновляем статус в БД
-        db.approve_advertisement(ad_id, message_id)
-        
-        # Уведомляем пользователя
-        try:
-            await bot.send_message(
-                chat_id=ad.user_id,
-                text=f"✅ <b>Ваше объявление #{ad_id} одобрено и опубликовано!</b>\n\n"
-                     f"Посмотреть: {config.CHANNEL_ID}",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Не удалось уведомить пользователя {ad.user_id}: {e}")
-        
-        await callback.answer("✅ Объявление опубликовано!", show_alert=True)
-        
-        # Обновляем сообщение с объявлением
-        try:
-            await callback.message.edit_reply_markup(reply_markup=None)
-            if callback.message.text:
-                await callback.message.edit_text(
-                    callback.message.text + "\n\n✅ <b>ОДОБРЕНО</b>",
-                    parse_mode="HTML"
-                )
-        except:
-            pass
-            
-    except Exception as e:
-        await callback.answer(f"❌ Ошибка публикации: {e}", show_alert=True)
+    # Захват объявления и задача публикации пишутся одной транзакцией;
+    # публикацию и уведомления выполняет outbox_worker в фоне
+    moderator_message = {
+        "chat_id": callback.message.chat.id,
+        "message_id": callback.message.message_id,
+        "text": callback.message.html_text if callback.message.text else None
+    }
+    if not await adb.queue_publication(ad_id, {"moderator_message": moderator_message}):
+        await callback.answer("⚠️ Объявление уже обработано", show_alert=True)
+        return
+    
+    outbox_worker.wake()
+    await callback.answer("✅ Объявление одобрено и будет опубликовано", show_alert=True)
 
 
 @router.callback_query(F.data.startswith("reject_"))
@@ -292,7 +289,7 @@ async def start_reject(callback: CallbackQuery, state: FSMContext):
         return
     
     ad_id = int(callback.data.split("_")[1])
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         await callback.answer("❌ Объявление не найдено", show_alert=True)
@@ -303,7 +300,12 @@ async def start_reject(callback: CallbackQuery, state: FSMContext):
         return
     
     await state.set_state(RejectStates.waiting_for_reason)
-    await state.update_data(reject_ad_id=ad_id, reject_message=callback.message)
+    # Храним только идентификаторы сообщения: данные состояния сериализуются в JSON
+    await state.update_data(
+        reject_ad_id=ad_id,
+        reject_chat_id=callback.message.chat.id,
+        reject_message_id=callback.message.message_id
+    )
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_reject")]
@@ -341,69 +343,96 @@ async def receive_reject_reason(message: Message, state: FSMContext, bot: Bot):
     
     data = await state.get_data()
     ad_id = data.get("reject_ad_id")
-    original_message = data.get("reject_message")
+    original_chat_id = data.get("reject_chat_id")
+    original_message_id = data.get("reject_message_id")
     
     if not ad_id:
         await message.answer("❌ Ошибка: не найден ID объявления.")
         await state.clear()
         return
     
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         await message.answer("❌ Объявление не найдено.")
         await state.clear()
         return
     
-    # Отклоняем объявление
-    db.reject_advertisement(ad_id, reason)
+    # Отклоняем объявление (только если его ещё никто не обработал);
+    # уведомление автора и правка сообщения модератора уходят в outbox той же транзакцией
+    tasks = [("notify", {
+        "chat_id": ad.user_id,
+        "text": f"❌ <b>Ваше объявление #{ad_id} отклонено</b>\n\n"
+                f"📝 <b>Причина:</b>\n{reason}\n\n"
+                f"Вы можете создать новое объявление с учётом замечаний."
+    })]
+    if original_chat_id and original_message_id:
+        tasks.append(("moderator_update", {"chat_id": original_chat_id, "message_id": original_message_id}))
+    rejected = await adb.reject_advertisement(ad_id, reason, tasks)
     
     await state.clear()
     
-    # Уведомляем пользователя
-    try:
-        await bot.send_message(
-            chat_id=ad.user_id,
-            text=f"❌ <b>Ваше объявление #{ad_id} отклонено</b>\n\n"
-                 f"📝 <b>Причина:</b>\n{reason}\n\n"
-                 f"Вы можете создать новое объявление с учётом замечаний.",
-            parse_mode="HTML"
-        )
-        notification_status = "✅ Пользователь уведомлён"
-    except Exception as e:
-        notification_status = f"⚠️ Не удалось уведомить пользователя: {e}"
+    if not rejected:
+        await message.answer(f"⚠️ Объявление #{ad_id} уже обработано другим модератором.")
+        return
     
+    outbox_worker.wake()
     await message.answer(
         f"✅ <b>Объявление #{ad_id} отклонено</b>\n\n"
         f"📝 Причина: {reason}\n\n"
-        f"{notification_status}",
+        f"📨 Пользователь получит уведомление",
         parse_mode="HTML"
     )
-    
-    # Обновляем оригинальное сообщение с объявлением
-    if original_message:
-        try:
-            await original_message.edit_reply_markup(reply_markup=None)
-        except:
-            pass
+
+
+def format_latency(seconds: Optional[int]) -> str:
+    """Граница корзины времени модерации в читаемом виде"""
+    if seconds is None:
+        return "—"
+    if seconds == LATENCY_OVERFLOW_BUCKET:
+        return f"> {LATENCY_BUCKETS[-1] // 86400} дн."
+    if seconds < 3600:
+        return f"≤ {seconds // 60} мин"
+    if seconds < 86400:
+        return f"≤ {seconds // 3600} ч"
+    return f"≤ {seconds // 86400} дн."
 
 
 @router.message(Command("stats"))
-async def cmd_stats(message: Message):
+async def cmd_stats(message: Message, state: FSMContext):
     """Статистика (для админов)"""
     if not is_admin(message.from_user.id):
         await message.answer("⛔ У вас нет доступа к этой команде.")
         return
     
-    pending = db.get_pending_count()
-    banned_count = len(db.get_banned_users())
+    pending = await adb.get_pending_count()
+    banned_count = db.get_banned_count()
+    stats = await adb.get_moderation_stats(days=config.STATS_DAYS)
+    outbox = await adb.get_outbox_counts()
+    fsm = await state.storage.stats()
     
-    await message.answer(
+    text = (
         "📊 <b>Статистика</b>\n\n"
         f"⏳ На модерации: {pending}\n"
-        f"🚫 Забанено: {banned_count}\n",
-        parse_mode="HTML"
+        f"🚫 Забанено: {banned_count}\n"
+        f"📨 В очереди отправки: {outbox.get('pending', 0)}, с ошибкой: {outbox.get('dead', 0)}\n"
+        f"💾 Состояний FSM: {fsm['stored']} на диске, {fsm['cached']} в памяти\n\n"
+        f"📅 <b>За {config.STATS_DAYS} дн.</b> (📝 подано / ✅ одобрено / ❌ отклонено):\n"
+    )
+    
+    if stats.days:
+        for day in stats.days:
+            text += f"<code>{day.day}</code>: {day.submitted} / {day.approved} / {day.rejected}\n"
+    else:
+        text += "Нет данных\n"
+    
+    text += (
+        f"\n⏱ <b>Время модерации:</b>\n"
+        f"Медиана: {format_latency(stats.latency_median)}\n"
+        f"95%: {format_latency(stats.latency_p95)}"
     )
+    
+    await message.answer(text, parse_mode="HTML")
 
 
 @router.message(Command("ban"))
@@ -432,8 +461,8 @@ async def cmd_ban(message: Message, state: FSMContext):
         return
     
     # Проверяем, не забанен ли уже
-    if db.is_banned(user_id):
-        ban_info = db.get_ban_info(user_id)
+    ban_info = db.get_ban_info(user_id)
+    if ban_info:
         await message.answer(
             f"⚠️ Пользователь <code>{user_id}</code> уже забанен.\n\n"
             f"📝 Причина: {ban_info.reason}\n"
@@ -487,7 +516,7 @@ async def receive_ban_reason(message: Message, state: FSMContext, bot: Bot):
         return
     
     # Баним пользователя
-    db.ban_user(
+    await adb.ban_user(
         user_id=user_id,
         username=None,  # Можно было бы получить из объявлений
         reason=reason,
@@ -545,7 +574,7 @@ async def cmd_unban(message: Message, bot: Bot):
         await message.answer(f"⚠️ Пользователь <code>{user_id}</code> не забанен.", parse_mode="HTML")
         return
     
-    db.unban_user(user_id)
+    await adb.unban_user(user_id)
     
     # Пытаемся уведомить пользователя
     try:
@@ -573,36 +602,13 @@ async def cmd_banlist(message: Message):
         await message.answer("⛔ У вас нет доступа к этой команде.")
         return
     
-    banned_users = db.get_banned_users()
+    page = await build_banlist_page()
     
-    if not banned_users:
+    if not page:
         await message.answer("✅ Нет забаненных пользователей.")
         return
     
-    # Создаём кнопки разбана для каждого пользователя
-    buttons = []
-    text = "🚫 <b>Забаненные пользователи:</b>\n\n"
-    
-    for i, user in enumerate(banned_users[:10]):  # Максимум 10
-        username_text = f"@{user.username}" if user.username else "—"
-        text += (
-            f"{i+1}. <code>{user.user_id}</code> ({username_text})\n"
-            f"   📝 {user.reason}\n"
-            f"   📅 {user.banned_at.strftime('%d.%m.%Y')}\n\n"
-        )
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"✅ Разбанить {user.user_id}",
-                callback_data=f"unban_{user.user_id}"
-            )
-        ])
-    
-    if len(banned_users) > 10:
-        text += f"<i>...и ещё {len(banned_users) - 10}</i>\n"
-        text += f"<i>Для полного списка: /banlist_all</i>"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
-    
+    text, keyboard = page
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 
@@ -619,7 +625,7 @@ async def unban_callback(callback: CallbackQuery, bot: Bot):
         await callback.answer("⚠️ Пользователь уже разбанен", show_alert=True)
         return
     
-    db.unban_user(user_id)
+    await adb.unban_user(user_id)
     
     # Пытаемся уведомить пользователя
     try:
@@ -634,31 +640,14 @@ async def unban_callback(callback: CallbackQuery, bot: Bot):
     
     await callback.answer(f"✅ Пользователь {user_id} разбанен!", show_alert=True)
     
-    # Обновляем список
-    banned_users = db.get_banned_users()
+    # Обновляем список (с первой страницы)
+    page = await build_banlist_page()
     
-    if not banned_users:
+    if not page:
         await callback.message.edit_text("✅ Нет забаненных пользователей.")
         return
     
-    buttons = []
-    text = "🚫 <b>Забаненные пользователи:</b>\n\n"
-    
-    for i, user in enumerate(banned_users[:10]):
-        username_text = f"@{user.username}" if user.username else "—"
-        text += (
-            f"{i+1}. <code>{user.user_id}</code> ({username_text})\n"
-            f"   📝 {user.reason}\n"
-            f"   📅 {user.banned_at.strftime('%d.%m.%Y')}\n\n"
-        )
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"✅ Разбанить {user.user_id}",
-                callback_data=f"unban_{user.user_id}"
-            )
-        ])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+    text, keyboard = page
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
 
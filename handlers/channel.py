@@ -6,6 +6,7 @@ from aiogram.types import ChatMemberUpdated
 from aiogram.filters import ChatMemberUpdatedFilter, IS_NOT_MEMBER, IS_MEMBER
 
 from config import config
+from outbound import Priority, send_priority
 
 router = Router()
 
@@ -29,12 +30,14 @@ async def on_user_joined_channel(event: ChatMemberUpdated, bot: Bot):
         return
     
     # Отправляем приветственное сообщение в личку
+    # Приветствия — массовый трафик, пропускаем вперёд остальные сообщения
     try:
-        await bot.send_message(
-            chat_id=user.id,
-            text=config.WELCOME_MESSAGE,
-            parse_mode="HTML"
-        )
+        with send_priority(Priority.BULK):
+            await bot.send_message(
+                chat_id=user.id,
+                text=config.WELCOME_MESSAGE,
+                parse_mode="HTML"
+            )
     except Exception as e:
         # Пользователь не начал диалог с ботом - это нормально
         print(f"Не удалось отправить приветствие {user.id}: {e}")
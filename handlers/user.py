@@ -1,21 +1,25 @@
 """
 Обработчики команд пользователей
 """
-import asyncio
-from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+import logging
+from typing import Optional
+
+from aiogram import Router, F, Bot, flags
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, PhotoSize
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InputMediaPhoto
 
+from albums import Album, MediaGroupCollector
 from config import config
-from database import db, AdStatus
+from database import adb, AdPhoto, AdStatus
+from outbox import moderation_recipients, outbox_worker
 
-router = Router()
+logger = logging.getLogger(__name__)
 
-# Хранилище для сбора альбомов (media_group)
-album_data: dict[str, dict] = {}
+router = Router()
 
 
 class AddAdStates(StatesGroup):
@@ -60,6 +64,7 @@ def get_confirm_keyboard() -> ReplyKeyboardMarkup:
 
 
 @router.message(Command("start"))
+@flags.throttle("info")
 async def cmd_start(message: Message, state: FSMContext):
     """Обработчик команды /start"""
     await state.clear()
@@ -86,6 +91,7 @@ async def cancel_action(message: Message, state: FSMContext):
 
 @router.message(F.text == "📜 Правила")
 @router.message(Command("rules"))
+@flags.throttle("info")
 async def show_rules(message: Message):
     """Показать правила"""
     await message.answer(
@@ -97,6 +103,7 @@ async def show_rules(message: Message):
 
 @router.message(F.text == "📞 Контакты")
 @router.message(Command("contacts"))
+@flags.throttle("info")
 async def show_contacts(message: Message):
     """Показать контакты"""
     await message.answer(
@@ -108,6 +115,7 @@ async def show_contacts(message: Message):
 
 @router.message(F.text == "📢 Реклама")
 @router.message(Command("ads"))
+@flags.throttle("info")
 async def show_advertising(message: Message):
     """Показать информацию о рекламе"""
     await message.answer(
@@ -118,22 +126,12 @@ async def show_advertising(message: Message):
 
 
 @router.message(F.text == "📝 Добавить объявление")
+@flags.throttle("add_ad")
 async def start_add_ad(message: Message, state: FSMContext):
     """Начало добавления объявления"""
-    # Проверяем бан
-    if db.is_banned(message.from_user.id):
-        ban_info = db.get_ban_info(message.from_user.id)
-        await message.answer(
-            f"🚫 <b>Вы заблокированы</b>\n\n"
-            f"📝 Причина: {ban_info.reason}\n\n"
-            f"Для разблокировки обратитесь к администратору.",
-            reply_markup=get_main_keyboard(),
-            parse_mode="HTML"
-        )
-        return
-    
+    # Бан проверяется раньше, в BanMiddleware
     # Проверяем лимит объявлений за день
-    ads_today = db.get_user_ads_today(message.from_user.id)
+    ads_today = await adb.get_user_ads_today(message.from_user.id)
     if ads_today >= config.MAX_ADS_PER_DAY:
         await message.answer(
             f"⚠️ <b>Вы достигли лимита объявлений на сегодня!</b>\n\n"
@@ -175,7 +173,7 @@ async def receive_photo_with_caption(message: Message, state: FSMContext, bot: B
         return
     
     # Одиночное фото
-    photo_id = message.photo[-1].file_id
+    photo = message.photo[-1]
     caption = message.caption or ""
     
     # Проверяем описание
@@ -197,7 +195,7 @@ async def receive_photo_with_caption(message: Message, state: FSMContext, bot: B
         return
     
     # Сохраняем данные и переходим к подтверждению
-    await state.update_data(photos=[photo_id], description=caption.strip())
+    await state.update_data(photos=[photo.file_id], photo_info=[photo_info(photo)], description=caption.strip())
     await state.set_state(AddAdStates.confirm)
     
     await message.answer(
@@ -212,53 +210,33 @@ async def receive_photo_with_caption(message: Message, state: FSMContext, bot: B
 
 async def handle_album(message: Message, state: FSMContext):
     """Обработка альбома (несколько фото)"""
-    media_group_id = message.media_group_id
-    user_id = message.from_user.id
-    key = f"{user_id}_{media_group_id}"
-    
-    # Инициализируем хранилище для этого альбома
-    if key not in album_data:
-        album_data[key] = {
-            "photos": [],
-            "caption": None,
-            "message": message,
-            "state": state,
-            "processed": False
-        }
-    
-    # Добавляем фото
-    photo_id = message.photo[-1].file_id
-    album_data[key]["photos"].append(photo_id)
-    
-    # Сохраняем подпись (берём из первого фото с подписью)
-    if message.caption and not album_data[key]["caption"]:
-        album_data[key]["caption"] = message.caption.strip()
-    
-    # Запускаем обработку с задержкой (ждём все фото альбома)
-    asyncio.create_task(process_album_delayed(key, state))
+    key = f"{message.from_user.id}_{message.media_group_id}"
+    album_collector.add(
+        key,
+        message=message,
+        state=state,
+        photo=message.photo[-1],
+        caption=message.caption
+    )
 
 
-async def process_album_delayed(key: str, state: FSMContext):
-    """Обработка альбома после небольшой задержки"""
-    await asyncio.sleep(0.5)  # Ждём все фото альбома
-    
-    if key not in album_data or album_data[key]["processed"]:
-        return
-    
-    album_data[key]["processed"] = True
-    data = album_data[key]
-    photos = data["photos"]
-    caption = data["caption"]
-    message = data["message"]
-    
-    # Очищаем данные
-    del album_data[key]
+def photo_info(photo: PhotoSize) -> list:
+    """Данные фото для ad_photos в компактном виде (file_id хранится в photos)"""
+    return [photo.file_unique_id, photo.width, photo.height]
+
+
+async def process_album(album: Album):
+    """Обработка альбома после получения всех фото"""
+    photos = [photo.file_id for photo in album.photos]
+    caption = album.caption
+    message = album.message
+    state = album.state
     
     # Проверяем количество фото
-    if len(photos) > config.MAX_PHOTOS:
+    if album.count > config.MAX_PHOTOS:
         await message.answer(
             f"⚠️ Максимум {config.MAX_PHOTOS} фотографий!\n"
-            f"Вы отправили: {len(photos)}\n"
+            f"Вы отправили: {album.count}\n"
             f"Попробуйте ещё раз с меньшим количеством."
         )
         return
@@ -282,7 +260,11 @@ async def process_album_delayed(key: str, state: FSMContext):
         return
     
     # Сохраняем данные и переходим к подтверждению
-    await state.update_data(photos=photos, description=caption)
+    await state.update_data(
+        photos=photos,
+        photo_info=[photo_info(photo) for photo in album.photos],
+        description=caption
+    )
     await state.set_state(AddAdStates.confirm)
     
     await message.answer(
@@ -295,7 +277,27 @@ async def process_album_delayed(key: str, state: FSMContext):
     )
 
 
+async def reject_album(message: Message):
+    """Ответ на альбом, отброшенный из-за перегрузки"""
+    await message.answer(
+        "⚠️ Сейчас бот перегружен, альбом не принят.\n"
+        "Отправьте его ещё раз через минуту."
+    )
+
+
+# Сборщик альбомов: один таймер на media_group, callback вызывается один раз
+album_collector = MediaGroupCollector(
+    process_album,
+    delay=config.ALBUM_COLLECT_DELAY,
+    ttl=config.ALBUM_TTL,
+    max_photos=config.MAX_PHOTOS,
+    max_albums=config.ALBUM_MAX_PENDING,
+    on_overflow=reject_album
+)
+
+
 @router.message(AddAdStates.waiting_for_content)
+@flags.throttle("info")
 async def invalid_content_input(message: Message):
     """Неверный ввод"""
     await message.answer(
@@ -310,6 +312,7 @@ async def invalid_content_input(message: Message):
 
 
 @router.message(AddAdStates.confirm, F.text == "✅ Отправить на модерацию")
+@flags.throttle("add_ad")
 async def confirm_ad(message: Message, state: FSMContext, bot: Bot):
     """Подтверждение и отправка на модерацию"""
     data = await state.get_data()
@@ -321,65 +324,83 @@ async def confirm_ad(message: Message, state: FSMContext, bot: Bot):
         await state.clear()
         return
     
-    # Сохраняем в БД
-    ad_id = db.add_advertisement(
+    # У черновиков, начатых до появления photo_info, есть только file_id
+    info = data.get("photo_info")
+    ad_photos = None
+    if info and len(info) == len(photos):
+        ad_photos = [AdPhoto(file_id, *details) for file_id, details in zip(photos, info)]
+    
+    # Сохраняем в БД (лимит проверяется атомарно вместе со вставкой)
+    ad_id = await adb.add_advertisement(
         user_id=message.from_user.id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
         description=description,
-        photo_ids=photos
+        photo_ids=photos,
+        daily_limit=config.MAX_ADS_PER_DAY,
+        photos=ad_photos,
+        # Рассылку модераторам выполняет outbox_worker, она переживёт перезапуск бота
+        tasks=[("moderation", {"chat_id": chat_id}) for chat_id in moderation_recipients()]
     )
     
     await state.clear()
     
+    if ad_id is None:
+        await message.answer(
+            f"⚠️ <b>Вы достигли лимита объявлений на сегодня!</b>\n\n"
+            f"Максимум {config.MAX_ADS_PER_DAY} объявлений в день.\n\n"
+            f"Попробуйте завтра 🙏",
+            reply_markup=get_main_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    
     await message.answer(
         f"✅ <b>Объявление #{ad_id} отправлено на модерацию!</b>\n\n"
         "Вы получите уведомление после проверки.",
         reply_markup=get_main_keyboard(),
         parse_mode="HTML"
     )
-    
-    # Отправляем уведомление админам
-    await notify_admins_new_ad(bot, ad_id, message.from_user, photos, description)
+    outbox_worker.wake()
 
 
 @router.message(AddAdStates.confirm, F.text == "🔄 Начать заново")
+@flags.throttle("add_ad")
 async def restart_ad(message: Message, state: FSMContext):
     """Начать создание объявления заново"""
     await start_add_ad(message, state)
 
 
-@router.message(F.text == "📋 Мои объявления")
-async def my_ads(message: Message):
-    """Показать объявления пользователя"""
-    ads = db.get_user_advertisements(message.from_user.id)
+MY_ADS_EMPTY_TEXT = (
+    "📭 У вас пока нет объявлений.\n"
+    "Нажмите «📝 Добавить объявление» чтобы создать первое!"
+)
+
+
+async def build_my_ads_page(user_id: int, before_id: Optional[int] = None) -> Optional[tuple[str, InlineKeyboardMarkup]]:
+    """Текст и клавиатура страницы «Мои объявления» (None, если объявлений нет)"""
+    page_size = config.MY_ADS_PAGE_SIZE
+    # Берём на одно больше, чтобы понять, есть ли следующая страница
+    ads = await adb.get_user_ads_page(user_id, before_id, limit=page_size + 1)
+    has_more = len(ads) > page_size
+    ads = ads[:page_size]
     
     if not ads:
-        await message.answer(
-            "📭 У вас пока нет объявлений.\n"
-            "Нажмите «📝 Добавить объявление» чтобы создать первое!",
-            reply_markup=get_main_keyboard()
-        )
-        return
+        return None
     
     status_emoji = {
         AdStatus.PENDING: "⏳",
+        AdStatus.PUBLISHING: "⏳",
         AdStatus.APPROVED: "✅",
         AdStatus.REJECTED: "❌"
     }
     
-    status_text = {
-        AdStatus.PENDING: "На модерации",
-        AdStatus.APPROVED: "Опубликовано",
-        AdStatus.REJECTED: "Отклонено"
-    }
-    
     text = "📋 <b>Ваши объявления:</b>\n\n"
     text += "Нажмите на объявление, чтобы посмотреть детали или удалить.\n\n"
     
     # Создаём inline-кнопки для каждого объявления
     buttons = []
-    for ad in ads[:10]:  # Показываем последние 10
+    for ad in ads:
         emoji = status_emoji.get(ad.status, "❓")
         desc_preview = ad.description[:30] + "..." if len(ad.description) > 30 else ad.description
         # Убираем переносы строк из превью
@@ -392,16 +413,38 @@ async def my_ads(message: Message):
             )
         ])
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    # Навигация по страницам
+    navigation = []
+    if before_id is not None:
+        navigation.append(InlineKeyboardButton(text="⏮ В начало", callback_data="myads_back"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(text="➡️ Дальше", callback_data=f"myads_page_{ads[-1].id}"))
+    if navigation:
+        buttons.append(navigation)
+    
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@router.message(F.text == "📋 Мои объявления")
+@flags.throttle("my_ads")
+async def my_ads(message: Message):
+    """Показать объявления пользователя"""
+    page = await build_my_ads_page(message.from_user.id)
+    
+    if not page:
+        await message.answer(MY_ADS_EMPTY_TEXT, reply_markup=get_main_keyboard())
+        return
     
+    text, keyboard = page
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 
 @router.callback_query(F.data.startswith("myad_"))
+@flags.throttle("my_ads")
 async def view_my_ad(callback: CallbackQuery, bot: Bot):
     """Просмотр своего объявления"""
     ad_id = int(callback.data.split("_")[1])
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         await callback.answer("❌ Объявление не найдено", show_alert=True)
@@ -414,6 +457,7 @@ async def view_my_ad(callback: CallbackQuery, bot: Bot):
     
     status_text = {
         AdStatus.PENDING: "⏳ На модерации",
+        AdStatus.PUBLISHING: "⏳ Публикуется",
         AdStatus.APPROVED: "✅ Опубликовано",
         AdStatus.REJECTED: "❌ Отклонено"
     }
@@ -466,41 +510,23 @@ async def view_my_ad(callback: CallbackQuery, bot: Bot):
 
 
 @router.callback_query(F.data == "myads_back")
+@router.callback_query(F.data.startswith("myads_page_"))
+@flags.throttle("my_ads")
 async def back_to_my_ads(callback: CallbackQuery):
-    """Вернуться к списку своих объявлений"""
-    ads = db.get_user_advertisements(callback.from_user.id)
+    """Вернуться к списку своих объявлений / перейти на следующую страницу"""
+    # myads_page_<ID> — страница после объявления с этим ID
+    before_id = None
+    if callback.data.startswith("myads_page_"):
+        before_id = int(callback.data.split("_")[2])
     
-    if not ads:
-        await callback.message.edit_text(
-            "📭 У вас пока нет объявлений.\n"
-            "Нажмите «📝 Добавить объявление» чтобы создать первое!"
-        )
+    page = await build_my_ads_page(callback.from_user.id, before_id)
+    
+    if not page:
+        await callback.message.edit_text(MY_ADS_EMPTY_TEXT)
         await callback.answer()
         return
     
-    status_emoji = {
-        AdStatus.PENDING: "⏳",
-        AdStatus.APPROVED: "✅",
-        AdStatus.REJECTED: "❌"
-    }
-    
-    text = "📋 <b>Ваши объявления:</b>\n\n"
-    text += "Нажмите на объявление, чтобы посмотреть детали или удалить.\n\n"
-    
-    buttons = []
-    for ad in ads[:10]:
-        emoji = status_emoji.get(ad.status, "❓")
-        desc_preview = ad.description[:30] + "..." if len(ad.description) > 30 else ad.description
-        desc_preview = desc_preview.replace("\n", " ")
-        
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"{emoji} #{ad.id}: {desc_preview}",
-                callback_data=f"myad_{ad.id}"
-            )
-        ])
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+    text, keyboard = page
     
     try:
         await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
@@ -511,10 +537,11 @@ async def back_to_my_ads(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("deladconfirm_"))
+@flags.throttle("my_ads")
 async def confirm_delete_ad(callback: CallbackQuery):
     """Подтверждение удаления объявления"""
     ad_id = int(callback.data.split("_")[1])
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         await callback.answer("❌ Объявление не найдено", show_alert=True)
@@ -541,11 +568,12 @@ async def confirm_delete_ad(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delad_"))
+@flags.throttle("my_ads")
 async def delete_my_ad(callback: CallbackQuery, bot: Bot):
     """Удаление объявления"""
     print(f"[DEBUG] delete_my_ad called with callback.data: {callback.data}")
     ad_id = int(callback.data.split("_")[1])
-    ad = db.get_advertisement(ad_id)
+    ad = await adb.get_advertisement(ad_id)
     
     if not ad:
         print(f"[DEBUG] Ad {ad_id} not found")
@@ -561,7 +589,7 @@ async def delete_my_ad(callback: CallbackQuery, bot: Bot):
     
     # Удаляем объявление из БД
     print(f"[DEBUG] Attempting to delete ad {ad_id}")
-    success = db.delete_advertisement(ad_id, callback.from_user.id)
+    success = await adb.delete_advertisement(ad_id, callback.from_user.id)
     print(f"[DEBUG] Delete result: {success}")
     
     if success:
@@ -591,84 +619,3 @@ async def delete_my_ad(callback: CallbackQuery, bot: Bot):
     else:
         print(f"[DEBUG] Delete from DB failed")
         await callback.answer("❌ Не удалось удалить объявление", show_alert=True)
-
-
-async def notify_admins_new_ad(bot: Bot, ad_id: int, user, photos: list, description: str):
-    """Отправляет уведомление админам о новом объявлении"""
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-    
-    # Клавиатура для модерации
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad_id}"),
-            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{ad_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🚫 Забанить", callback_data=f"ban_user_{user.id}")
-        ]
-    ])
-    
-    username_text = f"@{user.username}" if user.username else "нет username"
-    
-    # Получаем количество объявлений пользователя за сегодня
-    ads_today = db.get_user_ads_today(user.id)
-    
-    caption = (
-        f"🆕 <b>Новое объявление #{ad_id}</b>\n\n"
-        f"👤 От: {user.first_name} ({username_text})\n"
-        f"🆔 User ID: <code>{user.id}</code>\n"
-        f"📊 Объявление за сутки: <b>{ads_today}/{config.MAX_ADS_PER_DAY}</b>\n\n"
-        f"📝 <b>Описание:</b>\n{description}"
-    )
-    
-    # Отправляем админам
-    for admin_id in config.ADMIN_IDS:
-        try:
-            if len(photos) == 1:
-                await bot.send_photo(
-                    chat_id=admin_id,
-                    photo=photos[0],
-                    caption=caption,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                # Отправляем альбом
-                media = [InputMediaPhoto(media=photo) for photo in photos]
-                media[0].caption = caption
-                media[0].parse_mode = "HTML"
-                
-                await bot.send_media_group(chat_id=admin_id, media=media)
-                # Кнопки отправляем отдельным сообщением
-                await bot.send_message(
-                    chat_id=admin_id,
-                    text=f"⬆️ Объявление #{ad_id} — выберите действие:",
-                    reply_markup=keyboard
-                )
-        except Exception as e:
-            print(f"Ошибка отправки админу {admin_id}: {e}")
-    
-    # Также отправляем в чат модерации, если указан
-    if config.MODERATION_CHAT_ID:
-        try:
-            if len(photos) == 1:
-                await bot.send_photo(
-                    chat_id=config.MODERATION_CHAT_ID,
-                    photo=photos[0],
-                    caption=caption,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                media = [InputMediaPhoto(media=photo) for photo in photos]
-                media[0].caption = caption
-                media[0].parse_mode = "HTML"
-                
-                await bot.send_media_group(chat_id=config.MODERATION_CHAT_ID, media=media)
-                await bot.send_message(
-                    chat_id=config.MODERATION_CHAT_ID,
-                    text=f"⬆️ Объявление #{ad_id} — выберите действие:",
-                    reply_markup=keyboard
-                )
-        except Exception as e:
-            print(f"Ошибка отправки в чат модерации: {e}")
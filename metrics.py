@@ -0,0 +1,271 @@
+"""
+Метрики в формате Prometheus и HTTP-эндпоинт /metrics
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+# Границы корзин гистограмм по умолчанию, секунд
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """Базовая метрика с метками; безопасна для вызова из потоков БД"""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # Для каждого набора меток: счётчики корзин (+Inf последним), сумма, количество
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATE_LATENCY = registry.register(Histogram(
+    "bot_update_duration_seconds",
+    "End-to-end update processing time",
+    ("type",)
+))
+HANDLER_UPDATES = registry.register(Counter(
+    "bot_handler_updates_total",
+    "Updates processed by handler",
+    ("handler", "event")
+))
+HANDLER_ERRORS = registry.register(Counter(
+    "bot_handler_errors_total",
+    "Handler invocations that raised an exception",
+    ("handler",)
+))
+HANDLER_LATENCY = registry.register(Histogram(
+    "bot_handler_duration_seconds",
+    "Handler execution time",
+    ("handler",)
+))
+DROPPED_UPDATES = registry.register(Counter(
+    "bot_dropped_updates_total",
+    "Updates dropped before reaching a handler",
+    ("reason",)
+))
+DB_QUERY_LATENCY = registry.register(Histogram(
+    "bot_db_query_duration_seconds",
+    "Database method execution time",
+    ("method",)
+))
+API_LATENCY = registry.register(Histogram(
+    "bot_api_request_duration_seconds",
+    "Bot API request time",
+    ("method",)
+))
+API_ERRORS = registry.register(Counter(
+    "bot_api_errors_total",
+    "Bot API requests that failed",
+    ("method", "error")
+))
+API_RETRY_AFTER = registry.register(Counter(
+    "bot_api_retry_after_total",
+    "Bot API requests rejected by flood control (RetryAfter)",
+    ("method",)
+))
+AD_CACHE_REQUESTS = registry.register(Counter(
+    "bot_ad_cache_requests_total",
+    "get_advertisement lookups by cache result",
+    ("result",)
+))
+FSM_CACHED = registry.register(Gauge(
+    "bot_fsm_cached_records",
+    "FSM records held in memory"
+))
+FSM_STORED = registry.register(Gauge(
+    "bot_fsm_stored_records",
+    "FSM records stored on disk"
+))
+FSM_EXPIRED = registry.register(Counter(
+    "bot_fsm_expired_total",
+    "FSM records removed by TTL or size limit"
+))
+
+
+@dataclass
+class UpdateTrace:
+    """Сводка по одному апдейту: какой обработчик и сколько времени ушло на БД и Bot API"""
+    handler: str = "unhandled"
+    db_time: float = 0.0
+    db_calls: int = 0
+    api_time: float = 0.0
+    api_calls: int = 0
+
+
+# Трейс апдейта, который сейчас обрабатывается (задаётся в UpdateTimingMiddleware)
+current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("update_trace", default=None)
+
+
+def trace_db(seconds: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.db_time += seconds
+        trace.db_calls += 1
+
+
+def trace_api(seconds: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.api_time += seconds
+        trace.api_calls += 1
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        text=registry.render(),
+        content_type="text/plain",
+        charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """Запускает HTTP-сервер с эндпоинтом /metrics (port=0 — выключено)"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
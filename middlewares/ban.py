@@ -0,0 +1,62 @@
+"""
+Отсев апдейтов от забаненных пользователей до роутеров
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from config import config
+from database import db
+from metrics import DROPPED_UPDATES
+
+
+class BanMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для message и callback_query.
+
+    Проверка бана — поиск в кэше банов Database (словарь в памяти,
+    обновляется в ban_user/unban_user), без запросов к БД. Забаненный
+    пользователь один раз получает сообщение о блокировке, остальные его
+    апдейты отбрасываются без ответа. Администраторы не проверяются.
+    """
+
+    def __init__(self, max_notified: int = 10000):
+        self.max_notified = max_notified
+        # Кому уже сообщили о бане: user_id -> время бана (при повторном бане сообщим снова)
+        self._notified: OrderedDict[int, Optional[datetime]] = OrderedDict()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user: Optional[User] = data.get("event_from_user")
+        if user is None or user.id in config.ADMIN_IDS:
+            return await handler(event, data)
+
+        ban_info = db.get_ban_info(user.id)
+        if ban_info is None:
+            return await handler(event, data)
+
+        DROPPED_UPDATES.inc(reason="banned")
+        if self._notified.get(user.id, 0) == ban_info.banned_at:
+            return None
+        self._notified[user.id] = ban_info.banned_at
+        self._notified.move_to_end(user.id)
+        while len(self._notified) > self.max_notified:
+            self._notified.popitem(last=False)
+
+        text = (
+            f"🚫 <b>Вы заблокированы</b>\n\n"
+            f"📝 Причина: {ban_info.reason}\n\n"
+            f"Для разблокировки обратитесь к администратору."
+        )
+        if isinstance(event, CallbackQuery):
+            await event.answer("🚫 Вы заблокированы", show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer(text, parse_mode="HTML")
+        return None
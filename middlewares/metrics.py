@@ -0,0 +1,85 @@
+"""
+Сбор метрик обработчиков и запросов к Bot API
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from metrics import (
+    API_ERRORS,
+    API_LATENCY,
+    API_RETRY_AFTER,
+    HANDLER_ERRORS,
+    HANDLER_LATENCY,
+    HANDLER_UPDATES,
+    current_trace,
+    trace_api,
+)
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Имя функции-обработчика, выбранной для апдейта"""
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", "unknown")
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Считает апдейты и время работы по каждому обработчику.
+
+    Подключается как inner-middleware, поэтому вызывается только когда
+    фильтры уже выбрали обработчик.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = handler_name(data)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.handler = name
+        HANDLER_UPDATES.inc(handler=name, event=type(event).__name__)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время, ошибки и RetryAfter запросов к Bot API (по методам)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            API_RETRY_AFTER.inc(method=name)
+            raise
+        except Exception as e:
+            # Ошибки Bot API, сетевые ошибки, таймауты
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            API_LATENCY.observe(elapsed, method=name)
+            trace_api(elapsed)
@@ -0,0 +1,81 @@
+"""
+Ограничение частоты действий пользователя (анти-флуд)
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject, User
+
+from config import config
+from metrics import DROPPED_UPDATES
+from outbound import TokenBucket
+
+# Лимиты по классам действий: (действий в секунду, запас подряд)
+THROTTLE_LIMITS: dict[str, tuple[float, float]] = {
+    "info": (1.0, 5),        # /start, правила, контакты, подсказки
+    "add_ad": (1 / 3, 4),    # Создание и отправка объявления
+    "my_ads": (1.0, 5),      # Список, просмотр и удаление своих объявлений
+}
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: token bucket на пользователя и класс действия.
+
+    Класс действия задаётся флагом обработчика: @flags.throttle("add_ad").
+    Обработчики без флага не ограничиваются. При превышении лимита
+    пользователь один раз получает предупреждение, остальные лишние
+    апдейты отбрасываются молча. Хранится не больше max_buckets бакетов,
+    давно не использованные вытесняются.
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, float]], max_buckets: int = 10000):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        # (user_id, класс) -> [бакет, предупреждён ли пользователь]
+        self._buckets: OrderedDict[tuple[int, str], list] = OrderedDict()
+
+    def _entry(self, user_id: int, action: str) -> list:
+        key = (user_id, action)
+        entry = self._buckets.get(key)
+        if entry is None:
+            rate, burst = self.limits[action]
+            entry = [TokenBucket(rate, burst), False]
+            self._buckets[key] = entry
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return entry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action = get_flag(data, "throttle")
+        user: Optional[User] = data.get("event_from_user")
+        if action not in self.limits or user is None or user.id in config.ADMIN_IDS:
+            return await handler(event, data)
+
+        entry = self._entry(user.id, action)
+        bucket = entry[0]
+        delay = bucket.delay()
+        if delay <= 0:
+            bucket.consume()
+            entry[1] = False
+            return await handler(event, data)
+
+        DROPPED_UPDATES.inc(reason="throttled")
+        if entry[1]:
+            # Без ответа на callback кнопка «крутится» до таймаута Telegram
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+        entry[1] = True
+        if isinstance(event, (CallbackQuery, Message)):
+            await event.answer(f"⏳ Слишком часто! Попробуйте через {max(1, round(delay))} с.")
+        return None
@@ -0,0 +1,61 @@
+"""
+Замер полного времени обработки апдейта и лог медленных апдейтов
+"""
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import UPDATE_LATENCY, UpdateTrace, current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на уровне апдейта.
+
+    Меряет обработку апдейта от начала до конца. Обработчик, время в БД
+    и в Bot API собираются в UpdateTrace из других middleware и AsyncDatabase.
+    Апдейты дольше threshold секунд пишутся в лог одной JSON-записью.
+    """
+
+    def __init__(self, threshold: float = 0.5):
+        self.threshold = threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = UpdateTrace()
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_trace.reset(token)
+            event_type = event.event_type if isinstance(event, Update) else type(event).__name__
+            UPDATE_LATENCY.observe(elapsed, type=event_type)
+            if elapsed >= self.threshold:
+                user = data.get("event_from_user")
+                record = {
+                    "update_id": getattr(event, "update_id", None),
+                    "type": event_type,
+                    "handler": trace.handler,
+                    "user_id": user.id if user else None,
+                    "total_ms": round(elapsed * 1000, 1),
+                    "db_ms": round(trace.db_time * 1000, 1),
+                    "db_calls": trace.db_calls,
+                    "api_ms": round(trace.api_time * 1000, 1),
+                    "api_calls": trace.api_calls,
+                }
+                logger.warning(
+                    f"🐢 Медленный апдейт: {json.dumps(record, ensure_ascii=False)}",
+                    extra={"update_trace": record}
+                )
@@ -0,0 +1,215 @@
+"""
+Планировщик исходящих запросов к Bot API с учётом лимитов Telegram
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    ForwardMessage,
+    Response,
+    SendDocument,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+# Методы, на которые распространяются лимиты отправки сообщений
+RATE_LIMITED_METHODS = (
+    SendMessage,
+    SendPhoto,
+    SendMediaGroup,
+    SendDocument,
+    CopyMessage,
+    ForwardMessage,
+    EditMessageText,
+    EditMessageCaption,
+    EditMessageReplyMarkup,
+)
+
+
+class Priority(IntEnum):
+    """Приоритет исходящего сообщения (меньше — важнее)"""
+    HIGH = 0      # Результаты модерации
+    NORMAL = 1    # Ответы пользователям
+    BULK = 2      # Массовые рассылки (приветствия подписчикам)
+
+
+_current_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.NORMAL)
+
+
+@contextmanager
+def send_priority(priority: Priority):
+    """Задаёт приоритет для запросов к Bot API внутри блока"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Пауза после RetryAfter
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float = 1.0) -> float:
+        """Сколько секунд ждать, пока хватит токенов"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # Запрос дороже ёмкости ждёт полного бакета, иначе он не пройдёт никогда
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1.0):
+        self.tokens -= min(cost, self.capacity)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Общая очередь исходящих сообщений бота.
+
+    Подключается к сессии бота как request-middleware, поэтому через неё
+    проходят все вызовы Bot API. Ограничивает скорость send_*/edit_*
+    глобально и для каждого чата, пропускает вперёд запросы с более
+    высоким приоритетом и повторяет любой запрос после TelegramRetryAfter.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        private_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 5.0,
+        max_retries: int = 3,
+        max_chats: int = 10000
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets: OrderedDict[Union[int, str], TokenBucket] = OrderedDict()
+        # Очередь за глобальными токенами: (приоритет, порядковый номер, стоимость, future)
+        self._queue: list[tuple[int, int, float, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Положительный ID — личный чат, отрицательный или @username — группа/канал
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > self.max_chats:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire_chat(self, bucket: TokenBucket, cost: float):
+        while True:
+            delay = bucket.delay(cost)
+            if delay <= 0:
+                bucket.consume(cost)
+                return
+            await asyncio.sleep(delay)
+
+    async def _acquire_global(self, priority: Priority, cost: float):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), cost, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        """Раздаёт глобальные токены в порядке приоритета"""
+        while self._queue:
+            _, _, cost, future = self._queue[0]
+            if future.done():
+                # Ожидающий запрос отменён
+                heapq.heappop(self._queue)
+                continue
+            delay = self.global_bucket.delay(cost)
+            if delay > 0:
+                # После паузы снова смотрим на голову очереди:
+                # за это время мог прийти запрос важнее
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._queue)
+            self.global_bucket.consume(cost)
+            future.set_result(None)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        # Лимиты скорости — только для отправки и правки сообщений,
+        # повтор после TelegramRetryAfter — для всех методов
+        bucket = None
+        cost = 1.0
+        if isinstance(method, RATE_LIMITED_METHODS) and getattr(method, "chat_id", None) is not None:
+            # Альбом считается за столько сообщений, сколько в нём фото
+            cost = float(len(method.media)) if isinstance(method, SendMediaGroup) else 1.0
+            bucket = self._chat_bucket(method.chat_id)
+        priority = _current_priority.get()
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await self._acquire_chat(bucket, cost)
+                await self._acquire_global(priority, cost)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                chat_id = getattr(method, "chat_id", None)
+                logger.warning(
+                    f"Flood control{f' для чата {chat_id}' if chat_id is not None else ''}: "
+                    f"повтор {type(method).__name__} через {e.retry_after} с"
+                )
+                if bucket is not None:
+                    bucket.blocked_until = time.monotonic() + e.retry_after
+                else:
+                    await asyncio.sleep(e.retry_after)
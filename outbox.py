@@ -0,0 +1,320 @@
+"""
+Фоновая отправка действий после модерации из таблицы outbox
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot, html
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+
+from config import config
+from database import adb, AdStatus, OutboxTask
+from outbound import Priority, send_priority
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """
+    Выполняет задачи из outbox: рассылку модераторам, публикацию в канал,
+    уведомления, правку сообщений модераторов.
+
+    Задачи записываются в одной транзакции с созданием объявления или сменой
+    его статуса, поэтому переживают перезапуск бота. Доставка «хотя бы один раз»:
+    если бот упадёт между отправкой в канал и записью результата,
+    публикация повторится после перезапуска.
+
+    Виды задач:
+    - moderation: новое объявление (ad_id) с кнопками модерации в чат {chat_id}
+    - moderation_buttons: кнопки модерации отдельным сообщением после альбома {chat_id}
+    - publish: публикация объявления (ad_id) в канал, затем одобрение и уведомления
+    - notify: сообщение {chat_id, text}
+    - moderator_update: снять кнопки с сообщения {chat_id, message_id}, заменив текст на text, если он указан
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = 1.0,
+        concurrency: int = 20,
+        max_attempts: int = 8,
+        retry_delay: float = 5.0,
+        shutdown_timeout: float = 10.0,
+        lease: float = 300.0
+    ):
+        self.poll_interval = poll_interval
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.shutdown_timeout = shutdown_timeout
+        self.lease = lease
+        self.bot: Optional[Bot] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Задачи outbox в работе: id -> asyncio.Task
+        self._running: dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает обработку.
+
+        Новые задачи не берутся, начатые получают shutdown_timeout секунд на
+        завершение: публикацию, прерванную между отправкой в канал и записью
+        результата, после перезапуска пришлось бы повторить. Оставшиеся
+        задачи отменяются и выполнятся после перезапуска.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        running = list(self._running.values())
+        if running:
+            _, pending = await asyncio.wait(running, timeout=self.shutdown_timeout)
+            if pending:
+                logger.warning(f"Outbox: не завершено задач за {self.shutdown_timeout:.0f} с: {len(pending)}")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    def wake(self):
+        """Сообщает, что в outbox появились новые задачи"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                free = self.concurrency - len(self._running)
+                if free > 0:
+                    # Задачи захватываются в БД атомарно — одна и та же не попадёт в работу дважды
+                    for task in await adb.claim_outbox_tasks(free, lease=self.lease):
+                        self._spawn(task)
+            except Exception as e:
+                logger.exception(f"Ошибка обработки outbox: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _spawn(self, task: OutboxTask):
+        running = asyncio.create_task(self._process(task))
+        self._running[task.id] = running
+
+        def done(_):
+            self._running.pop(task.id, None)
+            # Освободилось место — сразу берём следующую задачу
+            self._wakeup.set()
+
+        running.add_done_callback(done)
+
+    async def _process(self, task: OutboxTask):
+        try:
+            if task.kind == "moderation":
+                await self._send_to_moderator(task)
+            elif task.kind == "moderation_buttons":
+                await self._send_moderation_buttons(task)
+            elif task.kind == "publish":
+                await self._publish(task)
+            elif task.kind == "notify":
+                await self._notify(task)
+            elif task.kind == "moderator_update":
+                await self._update_moderator_message(task)
+            else:
+                logger.error(f"Неизвестный тип задачи outbox #{task.id}: {task.kind}")
+                await adb.fail_outbox_task(task.id, f"unknown kind {task.kind}")
+        except TelegramRetryAfter as e:
+            await adb.retry_outbox_task(task.id, str(e), e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован, чат или сообщение не найдены — повтор не поможет
+            logger.warning(f"Задача outbox #{task.id} ({task.kind}) отброшена: {e}")
+            await self._fail(task, str(e))
+        except Exception as e:
+            if task.attempts + 1 >= self.max_attempts:
+                logger.error(f"Задача outbox #{task.id} ({task.kind}) не выполнена: {e}")
+                await self._fail(task, str(e))
+            else:
+                delay = self.retry_delay * 2 ** task.attempts
+                logger.warning(f"Задача outbox #{task.id} ({task.kind}): {e}, повтор через {delay:.0f} с")
+                await adb.retry_outbox_task(task.id, str(e), delay)
+
+    async def _fail(self, task: OutboxTask, error: str):
+        if task.kind != "publish":
+            await adb.fail_outbox_task(task.id, error)
+            return
+        # Неопубликованное объявление возвращаем в очередь модерации,
+        # а модератору, которому обещали публикацию, сообщаем об ошибке
+        follow_up = []
+        moderator_message = task.payload.get("moderator_message")
+        if moderator_message:
+            follow_up.append(("notify", {
+                "chat_id": moderator_message["chat_id"],
+                "text": f"⚠️ <b>Не удалось опубликовать объявление #{task.ad_id}</b>\n\n"
+                        f"Ошибка: {html.quote(error)}\n"
+                        f"Объявление возвращено на модерацию."
+            }))
+        await adb.fail_outbox_task(task.id, error, release_ad_id=task.ad_id, tasks=follow_up)
+        self.wake()
+
+    async def _send_to_moderator(self, task: OutboxTask):
+        ad = await adb.get_advertisement(task.ad_id)
+        if not ad or ad.status != AdStatus.PENDING:
+            # Объявление удалено или уже рассмотрено другим модератором
+            await adb.complete_outbox_task(task.id)
+            return
+
+        username_text = f"@{ad.username}" if ad.username else "нет username"
+        ads_today = await adb.get_user_ads_today(ad.user_id)
+        # Объявления с теми же фото (повторная публикация или чужие фото)
+        duplicates = await adb.find_duplicate_photo_ads(ad.id)
+
+        caption = (
+            f"🆕 <b>Новое объявление #{ad.id}</b>\n\n"
+            f"👤 От: {ad.first_name} ({username_text})\n"
+            f"🆔 User ID: <code>{ad.user_id}</code>\n"
+            f"📊 Объявление за сутки: <b>{ads_today}/{config.MAX_ADS_PER_DAY}</b>\n"
+        )
+        if duplicates:
+            caption += f"⚠️ Эти фото уже были в объявлениях: {', '.join(f'#{dup}' for dup in duplicates)}\n"
+        caption += f"\n📝 <b>Описание:</b>\n{ad.description}"
+
+        chat_id = task.payload["chat_id"]
+        if len(ad.photo_ids) == 1:
+            await self.bot.send_photo(
+                chat_id=chat_id,
+                photo=ad.photo_ids[0],
+                caption=caption,
+                reply_markup=moderation_keyboard(ad.id, ad.user_id),
+                parse_mode="HTML"
+            )
+            await adb.complete_outbox_task(task.id)
+            return
+
+        # Альбом и кнопки отдельным сообщением. Кнопки — следующей задачей,
+        # чтобы при ошибке их отправки альбом не повторялся
+        media = [InputMediaPhoto(media=photo) for photo in ad.photo_ids]
+        media[0].caption = caption
+        media[0].parse_mode = "HTML"
+        await self.bot.send_media_group(chat_id=chat_id, media=media)
+        await adb.complete_outbox_task(task.id, [("moderation_buttons", {"chat_id": chat_id})])
+        self.wake()
+
+    async def _send_moderation_buttons(self, task: OutboxTask):
+        ad = await adb.get_advertisement(task.ad_id)
+        if ad and ad.status == AdStatus.PENDING:
+            await self.bot.send_message(
+                chat_id=task.payload["chat_id"],
+                text=f"⬆️ Объявление #{ad.id} — выберите действие:",
+                reply_markup=moderation_keyboard(ad.id, ad.user_id)
+            )
+        await adb.complete_outbox_task(task.id)
+
+    async def _publish(self, task: OutboxTask):
+        ad = await adb.get_advertisement(task.ad_id)
+        if not ad or ad.status != AdStatus.PUBLISHING:
+            # Объявление удалено или уже опубликовано
+            await adb.complete_outbox_task(task.id)
+            return
+
+        username_text = f"@{ad.username}" if ad.username else ad.first_name
+        caption = (
+            f"📢 <b>Новое объявление</b>\n\n"
+            f"{ad.description}\n\n"
+            f"👤 Автор: {username_text}"
+        )
+
+        # Результаты модерации отправляем вне общей очереди
+        with send_priority(Priority.HIGH):
+            if len(ad.photo_ids) == 1:
+                msg = await self.bot.send_photo(
+                    chat_id=config.CHANNEL_ID,
+                    photo=ad.photo_ids[0],
+                    caption=caption,
+                    parse_mode="HTML"
+                )
+                message_id = msg.message_id
+            else:
+                media = [InputMediaPhoto(media=photo) for photo in ad.photo_ids]
+                media[0].caption = caption
+                media[0].parse_mode = "HTML"
+
+                msgs = await self.bot.send_media_group(chat_id=config.CHANNEL_ID, media=media)
+                message_id = msgs[0].message_id
+
+        follow_up = [("notify", {
+            "chat_id": ad.user_id,
+            "text": f"✅ <b>Ваше объявление #{ad.id} одобрено и опубликовано!</b>\n\n"
+                    f"Посмотреть: {config.CHANNEL_ID}"
+        })]
+        moderator_message = task.payload.get("moderator_message")
+        if moderator_message:
+            text = moderator_message.get("text")
+            follow_up.append(("moderator_update", {
+                "chat_id": moderator_message["chat_id"],
+                "message_id": moderator_message["message_id"],
+                "text": text + "\n\n✅ <b>ОДОБРЕНО</b>" if text else None
+            }))
+        await adb.complete_publication(task.id, ad.id, message_id, follow_up)
+        self.wake()
+
+    async def _notify(self, task: OutboxTask):
+        with send_priority(Priority.HIGH):
+            await self.bot.send_message(
+                chat_id=task.payload["chat_id"],
+                text=task.payload["text"],
+                parse_mode="HTML"
+            )
+        await adb.complete_outbox_task(task.id)
+
+    async def _update_moderator_message(self, task: OutboxTask):
+        chat_id = task.payload["chat_id"]
+        message_id = task.payload["message_id"]
+        if task.payload.get("text"):
+            # Правка текста без reply_markup заодно убирает кнопки
+            await self.bot.edit_message_text(
+                text=task.payload["text"],
+                chat_id=chat_id,
+                message_id=message_id,
+                parse_mode="HTML"
+            )
+        else:
+            await self.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+        await adb.complete_outbox_task(task.id)
+
+
+def moderation_keyboard(ad_id: int, user_id: int) -> InlineKeyboardMarkup:
+    """Кнопки модерации нового объявления"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{ad_id}"),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{ad_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🚫 Забанить", callback_data=f"ban_user_{user_id}")
+        ]
+    ])
+
+
+def moderation_recipients() -> list[int]:
+    """Админы и чат модерации, если указан"""
+    recipients = list(config.ADMIN_IDS)
+    if config.MODERATION_CHAT_ID:
+        recipients.append(config.MODERATION_CHAT_ID)
+    return recipients
+
+
+# Глобальный обработчик outbox (запускается в bot.py)
+outbox_worker = OutboxWorker(
+    poll_interval=config.OUTBOX_POLL_INTERVAL,
+    concurrency=config.OUTBOX_CONCURRENCY,
+    max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+    retry_delay=config.OUTBOX_RETRY_DELAY,
+    shutdown_timeout=config.OUTBOX_SHUTDOWN_TIMEOUT,
+    lease=config.OUTBOX_LEASE
+)
@@ -0,0 +1,272 @@
+"""
+Постоянное FSM-хранилище на SQLite
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from metrics import FSM_CACHED, FSM_EXPIRED, FSM_STORED
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StorageRecord:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)  # Последнее изменение, unix time
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище, переживающее перезапуск бота.
+
+    Чтение идёт из кэша в памяти (с диска — только при первом обращении
+    к ключу), а изменения копятся и записываются одной транзакцией раз
+    в flush_interval секунд. Данные состояния должны сериализоваться в JSON,
+    поэтому в них хранятся только идентификаторы (ID чата, сообщения,
+    объявления), а не объекты aiogram.
+
+    Память и диск ограничены: в кэше не больше max_cached записей
+    (вытесняются давно не использованные), на диске — не больше
+    max_entries. Состояния, которые не менялись дольше ttl секунд
+    (брошенные черновики), считаются пустыми и удаляются.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "fsm.db",
+        flush_interval: float = 1.0,
+        ttl: float = 24 * 3600,
+        max_cached: int = 10000,
+        max_entries: int = 100000,
+        cleanup_interval: float = 600.0
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.max_entries = max_entries
+        self.cleanup_interval = cleanup_interval
+        self._records: OrderedDict[str, StorageRecord] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
+        # Все операции с соединением выполняются в одном потоке
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_records (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_records(updated_at)")
+        self._conn.commit()
+        self._cleanup()
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny,
+        ))
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _read_row(self, key: str) -> StorageRecord:
+        row = self._conn.execute(
+            "SELECT state, data, (julianday(updated_at) - 2440587.5) * 86400 FROM fsm_records WHERE key = ?",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return StorageRecord()
+        return StorageRecord(state=row[0], data=json.loads(row[1]), updated_at=row[2])
+
+    def _cleanup(self) -> list[str]:
+        """Удаляет с диска просроченные записи и лишние сверх max_entries; возвращает их ключи"""
+        with self._conn:
+            removed = [row[0] for row in self._conn.execute(
+                "DELETE FROM fsm_records WHERE updated_at < datetime('now', ?) RETURNING key",
+                (f"-{int(self.ttl)} seconds",)
+            ).fetchall()]
+            removed += [row[0] for row in self._conn.execute(
+                """
+                DELETE FROM fsm_records WHERE key IN (
+                    SELECT key FROM fsm_records ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                )
+                RETURNING key
+                """,
+                (self.max_entries,)
+            ).fetchall()]
+            stored = self._conn.execute("SELECT COUNT(*) FROM fsm_records").fetchone()[0]
+        FSM_EXPIRED.inc(len(removed))
+        FSM_STORED.set(stored)
+        return removed
+
+    def _write_rows(self, rows: list[tuple[str, Optional[str], Optional[str]]]):
+        with self._conn:
+            for key, state, data in rows:
+                if data is None:
+                    self._conn.execute("DELETE FROM fsm_records WHERE key = ?", (key,))
+                else:
+                    self._conn.execute(
+                        """
+                        INSERT INTO fsm_records (key, state, data, updated_at)
+                        VALUES (?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                        ON CONFLICT(key) DO UPDATE SET
+                            state = excluded.state,
+                            data = excluded.data,
+                            updated_at = excluded.updated_at
+                        """,
+                        (key, state, data)
+                    )
+
+    async def _get_record(self, key: StorageKey) -> StorageRecord:
+        """Запись из кэша; при промахе — загрузка с диска"""
+        str_key = self._key(key)
+        record = self._records.get(str_key)
+        if record is None:
+            loaded = await self._run(self._read_row, str_key)
+            # Пока шло чтение, запись могла появиться из другого апдейта
+            record = self._records.setdefault(str_key, loaded)
+            self._evict(keep=str_key)
+        else:
+            self._records.move_to_end(str_key)
+        if not record.empty and time.time() - record.updated_at > self.ttl:
+            # Брошенный черновик: сбрасываем и удаляем с диска
+            record.state = None
+            record.data = {}
+            FSM_EXPIRED.inc()
+            self._dirty.add(str_key)
+            self._schedule_flush()
+        return record
+
+    def _evict(self, keep: Optional[str] = None):
+        """
+        Вытесняет из кэша давно не использованные записи, уже сохранённые на диск.
+
+        keep — только что загруженный ключ: вызывающий код сейчас его изменит.
+        """
+        excess = len(self._records) - self.max_cached
+        if excess > 0:
+            for str_key in list(self._records):
+                if excess == 0:
+                    break
+                if str_key not in self._dirty and str_key != keep:
+                    del self._records[str_key]
+                    excess -= 1
+        FSM_CACHED.set(len(self._records))
+
+    def _mark_dirty(self, key: StorageKey):
+        record = self._records.get(self._key(key))
+        if record is not None:
+            record.updated_at = time.time()
+        self._dirty.add(self._key(key))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._cleanup_later())
+
+    async def _cleanup_later(self):
+        await asyncio.sleep(self.cleanup_interval)
+        try:
+            removed = await self._run(self._cleanup)
+            if removed:
+                # Удалённые с диска записи убираем и из кэша, если их не успели изменить
+                for str_key in removed:
+                    if str_key not in self._dirty:
+                        self._records.pop(str_key, None)
+                FSM_CACHED.set(len(self._records))
+                logger.info(f"FSM: удалено просроченных записей: {len(removed)}")
+        except Exception as e:
+            logger.error(f"Не удалось очистить FSM-хранилище: {e}")
+
+    async def _flush_later(self):
+        # Изменения, пришедшие во время записи, уйдут следующей пачкой
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения на диск"""
+        if not self._dirty:
+            return
+        rows = []
+        for str_key in self._dirty:
+            record = self._records.get(str_key)
+            if record is None or record.empty:
+                rows.append((str_key, None, None))
+            else:
+                rows.append((str_key, record.state, json.dumps(record.data, ensure_ascii=False)))
+        self._dirty.clear()
+        try:
+            await self._run(self._write_rows, rows)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить FSM-состояния: {e}")
+            self._dirty.update(key for key, _, _ in rows)
+            return
+        # Пустые записи удалены с диска — в кэше они тоже не нужны
+        for str_key, state, _ in rows:
+            record = self._records.get(str_key)
+            if state is None and record is not None and record.empty and str_key not in self._dirty:
+                del self._records[str_key]
+        self._evict()
+
+    async def stats(self) -> dict[str, int]:
+        """Размер хранилища: записей в кэше, ожидающих записи и на диске"""
+        stored = await self._run(lambda: self._conn.execute("SELECT COUNT(*) FROM fsm_records").fetchone()[0])
+        FSM_STORED.set(stored)
+        return {"cached": len(self._records), "dirty": len(self._dirty), "stored": stored}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._get_record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._get_record(key)
+        return record.data.copy()
+
+    async def close(self) -> None:
+        for task in (self._flush_task, self._cleanup_task):
+            if task is not None and not task.done():
+                task.cancel()
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
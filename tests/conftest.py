@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# database и bot при импорте открывают глобальные БД — не трогаем рабочие файлы
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "ads.db"))
+os.environ.setdefault("FSM_DB_PATH", os.path.join(_tmp, "fsm.db"))
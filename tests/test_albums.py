@@ -0,0 +1,28 @@
+import asyncio
+
+from albums import MediaGroupCollector
+
+
+def test_album_over_limit_is_rejected_once():
+    """Сверх max_albums новый альбом отбрасывается, собираемый не страдает"""
+    async def scenario():
+        finished = []
+        rejected = []
+
+        async def callback(album):
+            finished.append((album.key, album.photos))
+
+        async def on_overflow(message):
+            rejected.append(message)
+
+        collector = MediaGroupCollector(callback, delay=0.05, max_albums=1, on_overflow=on_overflow)
+        collector.add("a", message="a1", state=None, photo="a1", caption="Описание")
+        collector.add("b", message="b1", state=None, photo="b1", caption="Описание")
+        collector.add("a", message="a2", state=None, photo="a2", caption=None)
+        collector.add("b", message="b2", state=None, photo="b2", caption=None)
+        await asyncio.sleep(0.2)
+        return finished, rejected
+
+    finished, rejected = asyncio.run(scenario())
+    assert finished == [("a", ["a1", "a2"])]
+    assert rejected == ["b1"]
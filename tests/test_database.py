@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import AdStatus, Database
+
+
+def test_banned_page_falls_back_to_first_page(tmp_path):
+    database = Database(str(tmp_path / "ads.db"))
+    try:
+        for user_id in range(1, 6):
+            database.ban_user(user_id, None, "спам", 1)
+
+        first, first_page = database.get_banned_page(limit=2)
+        assert first_page
+        second, first_page = database.get_banned_page(first[-1].user_id, limit=2)
+        assert not first_page
+        assert {user.user_id for user in first}.isdisjoint(user.user_id for user in second)
+
+        # Пользователя, на котором закончилась страница, разбанили
+        database.unban_user(first[-1].user_id)
+        fallback, first_page = database.get_banned_page(first[-1].user_id, limit=2)
+        assert first_page
+        assert fallback[0].user_id == first[0].user_id
+    finally:
+        database.close()
+
+
+def run_concurrently(*calls):
+    """Запускает вызовы одновременно в отдельных потоках и возвращает результаты по порядку"""
+    barrier = threading.Barrier(len(calls))
+
+    def run(call):
+        barrier.wait()
+        return call()
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        return list(executor.map(run, calls))
+
+
+def test_concurrent_approve_and_reject_have_one_winner(tmp_path):
+    database = Database(str(tmp_path / "ads.db"))
+    try:
+        for _ in range(20):
+            ad_id = database.add_advertisement(1, None, "Имя", "Описание объявления", ["photo"])
+            approved, rejected = run_concurrently(
+                lambda: database.queue_publication(ad_id),
+                lambda: database.reject_advertisement(ad_id, "спам")
+            )
+            assert approved != rejected
+            expected = AdStatus.PUBLISHING if approved else AdStatus.REJECTED
+            assert database.get_advertisement(ad_id).status == expected
+            # Outbox-задача появляется только у победившей публикации
+            assert database.get_outbox_counts() == ({"pending": 1} if approved else {})
+            for task in database.claim_outbox_tasks(10):
+                database.complete_outbox_task(task.id)
+    finally:
+        database.close()
+
+
+def test_concurrent_approves_queue_one_publication(tmp_path):
+    database = Database(str(tmp_path / "ads.db"))
+    try:
+        ad_id = database.add_advertisement(1, None, "Имя", "Описание объявления", ["photo"])
+        results = run_concurrently(*[lambda: database.queue_publication(ad_id)] * 4)
+        assert results.count(True) == 1
+        assert database.get_outbox_counts() == {"pending": 1}
+    finally:
+        database.close()
+
+
+def test_daily_limit_holds_under_concurrent_inserts(tmp_path):
+    database = Database(str(tmp_path / "ads.db"))
+    try:
+        limit = 3
+        results = run_concurrently(*[
+            lambda: database.add_advertisement(1, None, "Имя", "Описание объявления", ["photo"], daily_limit=limit)
+        ] * 10)
+        assert len([ad_id for ad_id in results if ad_id is not None]) == limit
+        assert database.get_user_ads_today(1) == limit
+    finally:
+        database.close()
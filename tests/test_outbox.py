@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+import outbox
+from database import AdStatus, AsyncDatabase, Database
+
+
+class FakeMessage:
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+
+
+class FakeBot:
+    """Запоминает отправленное; send_photo можно задержать, чтобы задача была в работе"""
+
+    def __init__(self):
+        self.sent: list[tuple[str, dict]] = []
+        self.photo_delay = 0.0
+
+    async def send_photo(self, **kwargs):
+        await asyncio.sleep(self.photo_delay)
+        self.sent.append(("send_photo", kwargs))
+        return FakeMessage(len(self.sent))
+
+    async def send_media_group(self, **kwargs):
+        self.sent.append(("send_media_group", kwargs))
+        return [FakeMessage(len(self.sent))]
+
+    async def send_message(self, **kwargs):
+        self.sent.append(("send_message", kwargs))
+        return FakeMessage(len(self.sent))
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    database = Database(str(tmp_path / "ads.db"))
+    monkeypatch.setattr(outbox, "adb", AsyncDatabase(database, max_workers=2))
+    yield database
+    database.close()
+
+
+def add_pending_ad(database: Database) -> int:
+    return database.add_advertisement(1, None, "Имя", "Описание объявления", ["photo"])
+
+
+def test_claimed_task_is_not_claimed_again(database):
+    ad_id = add_pending_ad(database)
+    assert database.queue_publication(ad_id)
+
+    first = database.claim_outbox_tasks(10)
+    assert [task.ad_id for task in first] == [ad_id]
+    # Пока задача в работе, повторный выбор её не возвращает
+    assert database.claim_outbox_tasks(10) == []
+
+    database.complete_outbox_task(first[0].id)
+    assert database.claim_outbox_tasks(10, lease=0) == []
+
+
+def test_completed_task_is_not_dispatched_again(database):
+    ad_id = add_pending_ad(database)
+    assert database.queue_publication(ad_id)
+
+    async def scenario():
+        bot = FakeBot()
+        bot.photo_delay = 0.05
+        worker = outbox.OutboxWorker(poll_interval=0.01, concurrency=5)
+        worker.start(bot)
+        # Несколько циклов выборки, пока публикация в работе и после её завершения
+        await asyncio.sleep(0.5)
+        await worker.stop()
+        return bot
+
+    bot = asyncio.run(scenario())
+    posts = [kwargs for name, kwargs in bot.sent if name == "send_photo"]
+    notices = [kwargs for name, kwargs in bot.sent if name == "send_message" and kwargs["chat_id"] == 1]
+    assert len(posts) == 1
+    assert len(notices) == 1
+    assert database.get_advertisement(ad_id).status == AdStatus.APPROVED
+    assert database.get_outbox_counts() == {}
+
+
+def run_worker(seconds: float = 0.3) -> FakeBot:
+    async def scenario():
+        bot = FakeBot()
+        worker = outbox.OutboxWorker(poll_interval=0.01, concurrency=5)
+        worker.start(bot)
+        await asyncio.sleep(seconds)
+        await worker.stop()
+        return bot
+
+    return asyncio.run(scenario())
+
+
+def test_new_album_is_sent_to_each_moderator_once(database):
+    recipients = [100, 200]
+    database.add_advertisement(
+        1, None, "Имя", "Описание объявления", ["photo1", "photo2"],
+        tasks=[("moderation", {"chat_id": chat_id}) for chat_id in recipients]
+    )
+
+    bot = run_worker()
+    for chat_id in recipients:
+        sent = [name for name, kwargs in bot.sent if kwargs["chat_id"] == chat_id]
+        # Альбом, затем кнопки отдельным сообщением
+        assert sent == ["send_media_group", "send_message"]
+    assert database.get_outbox_counts() == {}
+
+
+def test_moderated_ad_is_not_sent_to_moderators(database):
+    ad_id = database.add_advertisement(
+        1, None, "Имя", "Описание объявления", ["photo"],
+        tasks=[("moderation", {"chat_id": 100})]
+    )
+    assert database.reject_advertisement(ad_id, "спам")
+
+    bot = run_worker()
+    assert bot.sent == []
+    assert database.get_outbox_counts() == {}
@@ -0,0 +1,60 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_loaded_record_is_not_evicted_when_cache_is_dirty(tmp_path):
+    """Если все записи в кэше ещё не сохранены, новая запись не должна теряться"""
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=60, max_cached=2)
+        try:
+            for user_id in range(5):
+                await storage.set_state(key(user_id), f"Form:step{user_id}")
+                await storage.set_data(key(user_id), {"n": user_id})
+            for user_id in range(5):
+                assert await storage.get_state(key(user_id)) == f"Form:step{user_id}"
+                assert await storage.get_data(key(user_id)) == {"n": user_id}
+        finally:
+            await storage.close()
+
+        # И после записи на диск
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"))
+        try:
+            for user_id in range(5):
+                assert await storage.get_state(key(user_id)) == f"Form:step{user_id}"
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_cleanup_evicts_only_expired_records(tmp_path):
+    """Очистка убирает из кэша только записи, удалённые с диска"""
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), cleanup_interval=0)
+        try:
+            for user_id in (1, 2):
+                await storage.set_state(key(user_id), "Form:step")
+            await storage.flush()
+            # Запись 1 брошена двое суток назад
+            with storage._conn:
+                storage._conn.execute(
+                    "UPDATE fsm_records SET updated_at = datetime('now', '-2 days') WHERE key = ?",
+                    (storage._key(key(1)),)
+                )
+            await storage._cleanup_later()
+
+            assert storage._key(key(1)) not in storage._records
+            assert storage._key(key(2)) in storage._records
+            assert await storage.get_state(key(1)) is None
+            assert await storage.get_state(key(2)) == "Form:step"
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+"""
+Приём апдейтов через вебхук (альтернатива long polling)
+"""
+import asyncio
+import logging
+import secrets
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограничением числа одновременно обрабатываемых апдейтов.
+
+    Telegram получает ответ сразу, а сам апдейт обрабатывается в фоне,
+    не более concurrency апдейтов одновременно.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int = 100, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, allowed_updates: list[str]):
+    """Запускает aiohttp-сервер, принимающий апдейты от Telegram"""
+    secret = config.WEBHOOK_SECRET or None
+    if config.WEBHOOK_URL and not secret:
+        # Без секрета кто угодно может прислать апдейт от имени админа
+        secret = secrets.token_urlsafe(32)
+        logger.warning("⚠️ WEBHOOK_SECRET не задан — используется случайный секрет до перезапуска")
+    
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dp,
+        bot,
+        concurrency=config.WEBHOOK_CONCURRENCY,
+        secret_token=secret
+    )
+    handler.register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"🌐 Вебхук слушает {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=allowed_updates,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=config.DROP_PENDING_UPDATES
+        )
+    else:
+        # Локальный запуск: апдейты можно отправлять POST-запросами вручную
+        logger.warning("⚠️ WEBHOOK_URL не задан — вебхук в Telegram не регистрируется")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()